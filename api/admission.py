@@ -0,0 +1,137 @@
+"""
+Admission control for the analysis endpoints.
+
+A Limiter caps in-flight work globally and per doctor inside one web process
+and remembers recent completions, so a rejected caller can be told when a
+slot is likely to free up (Retry-After). Queue-depth limits live in the DB
+and are checked by the app; retry_after_from_rate() is shared by both.
+
+    slot = ANALYZE_LIMITER.acquire(doctor_id)
+    if not slot.ok:
+        return too_busy(slot.scope, slot.retry_after, "analyses")
+    try:
+        ...
+    finally:
+        slot.release()
+"""
+from __future__ import annotations
+import math, os, threading, time
+from collections import deque
+
+from flask import jsonify
+
+RETRY_AFTER_MIN = 1
+RETRY_AFTER_MAX = int(os.getenv("RETRY_AFTER_MAX", "300"))
+DRAIN_WINDOW_SECONDS = int(os.getenv("DRAIN_WINDOW_SECONDS", "300"))
+
+
+def env_limit(name: str, default: int) -> int:
+    """0 (or negative) disables a limit."""
+    return max(0, int(os.getenv(name, str(default))))
+
+
+def retry_after_from_rate(excess: int, rate_per_s: float, fallback: int = 30) -> int:
+    """Seconds until `excess` units drain at the observed rate, clamped to [1, RETRY_AFTER_MAX]."""
+    if rate_per_s <= 0:
+        return min(fallback, RETRY_AFTER_MAX)
+    return max(RETRY_AFTER_MIN, min(RETRY_AFTER_MAX, math.ceil(max(1, excess) / rate_per_s)))
+
+
+class Slot:
+    def __init__(self, limiter, doctor_id, ok, scope=None, retry_after=0):
+        self.limiter, self.doctor_id = limiter, doctor_id
+        self.ok, self.scope, self.retry_after = ok, scope, retry_after
+        self._released = not ok
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.limiter._release(self.doctor_id)
+
+
+class Limiter:
+    def __init__(self, name: str, global_limit: int, per_doctor_limit: int):
+        self.name = name
+        self.global_limit = global_limit
+        self.per_doctor_limit = per_doctor_limit
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._by_doctor = {}
+        self._done = deque()        # completion timestamps within DRAIN_WINDOW_SECONDS
+        self.rejected = 0
+
+    def _trim(self, now):
+        while self._done and now - self._done[0] > DRAIN_WINDOW_SECONDS:
+            self._done.popleft()
+
+    def drain_rate(self) -> float:
+        """Completions per second over the drain window."""
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            return len(self._done) / DRAIN_WINDOW_SECONDS
+
+    def acquire(self, doctor_id=None) -> Slot:
+        key = str(doctor_id) if doctor_id not in (None, "") else None
+        with self._lock:
+            scope = None
+            if self.global_limit and self._in_flight >= self.global_limit:
+                scope, excess = "global", self._in_flight - self.global_limit + 1
+            elif key is not None and self.per_doctor_limit and self._by_doctor.get(key, 0) >= self.per_doctor_limit:
+                scope, excess = "doctor", self._by_doctor[key] - self.per_doctor_limit + 1
+            if scope:
+                self.rejected += 1
+                self._trim(time.monotonic())
+                rate = len(self._done) / DRAIN_WINDOW_SECONDS
+                if scope == "doctor" and self._in_flight:
+                    # A doctor's own slots free up at their share of the overall rate
+                    rate *= self._by_doctor[key] / self._in_flight
+                return Slot(self, key, False, scope, retry_after_from_rate(excess, rate))
+            self._in_flight += 1
+            if key is not None:
+                self._by_doctor[key] = self._by_doctor.get(key, 0) + 1
+            return Slot(self, key, True)
+
+    def _release(self, key):
+        with self._lock:
+            self._in_flight -= 1
+            if key is not None:
+                left = self._by_doctor.get(key, 1) - 1
+                if left:
+                    self._by_doctor[key] = left
+                else:
+                    self._by_doctor.pop(key, None)
+            self._done.append(time.monotonic())
+
+    def snapshot(self) -> dict:
+        rate = self.drain_rate()
+        with self._lock:
+            return {
+                "limit": self.global_limit or None,
+                "per_doctor_limit": self.per_doctor_limit or None,
+                "in_flight": self._in_flight,
+                "in_flight_by_doctor": {str(k): v for k, v in self._by_doctor.items()},
+                "rejected": self.rejected,
+                "drain_rate_per_min": round(rate * 60, 2),
+            }
+
+
+def too_busy(scope: str, retry_after: int, what: str):
+    """429 when the caller is over their own limit, 503 when the service as a whole is saturated."""
+    status = 429 if scope == "doctor" else 503
+    resp = jsonify({
+        "error": f"Too many {what}" + (" for this doctor" if scope == "doctor" else "; server is at capacity"),
+        "scope": scope,
+        "retry_after": retry_after,
+    })
+    resp.status_code = status
+    resp.headers["Retry-After"] = str(retry_after)
+    return resp
+
+
+ANALYZE_LIMITER = Limiter("analyze",
+                          env_limit("MAX_INFLIGHT_ANALYZE", 4),
+                          env_limit("MAX_INFLIGHT_ANALYZE_PER_DOCTOR", 2))
+STREAM_LIMITER = Limiter("analyze_stream",
+                         env_limit("MAX_STREAMS", 8),
+                         env_limit("MAX_STREAMS_PER_DOCTOR", 2))
@@ -0,0 +1,90 @@
+"""
+Section index for model output: split an analysis into the ten headings
+build_prompt() asks for, so clients can fetch or diff one section at a time.
+
+    from analysis_sections import ANALYSIS_SECTIONS, SECTION_KEYS, parse_sections
+
+Only heading-shaped lines count: a "1." / "1)" number, a "#" or a "**"/"__"
+opener before the title, and nothing after it except ":" (and text following
+the colon). Headings must also appear in ANALYSIS_SECTIONS order, so a later
+mention of an earlier title stays in the body it belongs to.
+"""
+from __future__ import annotations
+import json, re
+
+# (key, heading) in the order build_prompt() asks the model for them
+ANALYSIS_SECTIONS = [
+    ("differential_diagnosis",   "Differential Diagnosis"),
+    ("pathophysiology",          "Pathophysiology Integration"),
+    ("diagnostic_workup",        "Diagnostic Workup"),
+    ("treatment_medications",    "Treatment and Medications"),
+    ("risk_stratification",      "Risk Stratification & Clinical Judgment"),
+    ("chronic_conditions",       "Management of Chronic Conditions"),
+    ("infection_antibiotics",    "Infection Consideration & Antibiotics"),
+    ("disposition_followup",     "Disposition & Follow-Up"),
+    ("red_flags",                "Red Flags or Missed Diagnoses"),
+    ("guidelines_integration",   "Clinical Guidelines Integration"),
+]
+SECTION_KEYS = [key for key, _ in ANALYSIS_SECTIONS]
+
+_HEADING_RE = re.compile(
+    r"^(?P<prefix>[ \t]*(?:[#>][ \t#>]*)?(?:[-*+][ \t]+)?(?:\*\*|__)?(?:\d{1,2}[ \t]*[.)][ \t]*)?(?:\*\*|__)?)[ \t]*"
+    r"(?P<title>" + "|".join(re.escape(title) for _, title in ANALYSIS_SECTIONS) + r")"
+    r"[ \t]*(?:\*\*|__)?[ \t]*(?::|\r?$)",
+    re.IGNORECASE | re.MULTILINE,
+)
+_PREFIX_MARK_RE = re.compile(r"\d|#|\*\*|__")
+_TITLE_TO_INDEX = {title.lower(): i for i, (_, title) in enumerate(ANALYSIS_SECTIONS)}
+
+
+def _headings(text: str) -> list:
+    """(match, index into ANALYSIS_SECTIONS) for each accepted heading, in order."""
+    found, last = [], -1
+    for m in _HEADING_RE.finditer(text or ""):
+        if not _PREFIX_MARK_RE.search(m.group("prefix")):
+            continue
+        index = _TITLE_TO_INDEX[m.group("title").lower()]
+        if index > last:
+            found.append((m, index))
+            last = index
+    return found
+
+
+def parse_sections(analysis: str) -> dict:
+    """Split the model output into {section_key: text}; text before the first heading is dropped."""
+    sections = {}
+    headings = _headings(analysis)
+    for i, (m, index) in enumerate(headings):
+        end = headings[i + 1][0].start() if i + 1 < len(headings) else len(analysis)
+        # Drop a closing "**" after "Title:" but keep text on the heading line
+        sections[SECTION_KEYS[index]] = analysis[m.end():end].lstrip(" \t*_").strip()
+    return sections
+
+
+def current_section(text: str):
+    """Key of the last section heading seen so far in a partial analysis, or None."""
+    headings = _headings(text)
+    return SECTION_KEYS[headings[-1][1]] if headings else None
+
+
+def resolve_section_keys(raw: str) -> list:
+    """Accept "1,3", "differential_diagnosis,red_flags" or a mix; unknown names are ignored."""
+    keys = []
+    for part in (raw or "").split(","):
+        part = part.strip().lower()
+        if part.isdigit() and 1 <= int(part) <= len(SECTION_KEYS):
+            part = SECTION_KEYS[int(part) - 1]
+        if part in SECTION_KEYS and part not in keys:
+            keys.append(part)
+    return keys
+
+
+def load_sections(record: dict) -> dict:
+    """Stored section index, or parse on the fly for rows completed before it existed."""
+    raw = record.get("analysis_sections")
+    if raw:
+        try:
+            return json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+        except Exception:
+            pass
+    return parse_sections(record.get("analysis") or "")
@@ -1,12 +1,16 @@
 from __future__ import annotations
 from flask import Flask, request, jsonify, render_template_string
 from dotenv import load_dotenv
-import os, io, base64, json, traceback, threading, time
+import os, io, re, math, base64, json, zlib, socket, uuid, difflib, traceback, threading, time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 import mysql.connector
 from mysql.connector import Error
 from pathlib import Path
-from openai import OpenAI
-import httpx
+from http_encoding import install_json, install_compression
+from analysis_sections import ANALYSIS_SECTIONS, SECTION_KEYS, parse_sections, current_section, resolve_section_keys, load_sections
+from queue_priority import PRIORITY_NAMES, job_priority
+from admission import ANALYZE_LIMITER, DRAIN_WINDOW_SECONDS, env_limit, retry_after_from_rate, too_busy
 # NEW
 from flask_cors import CORS
 
@@ -17,27 +21,64 @@ if not OPENAI_API_KEY:
     raise RuntimeError("OPENAI_API_KEY is missing. Set it in .env or environment variables.")
 
 # ---------- Image handling dependencies ----------
-try:
-    from PIL import Image as PILImage
-    HAVE_PIL = True
-except Exception:
-    PILImage = None
-    HAVE_PIL = False
+# Pillow / pydicom+numpy are only needed for image uploads, so they are imported on
+# first use instead of at startup. None = not tried yet.
+PILImage = None
+HAVE_PIL = None
+pydicom = None
+HAVE_DICOM = None
+_lazy_lock = threading.Lock()
+
+def load_pil():
+    global PILImage, HAVE_PIL
+    if HAVE_PIL is None:
+        with _lazy_lock:
+            if HAVE_PIL is None:
+                try:
+                    from PIL import Image
+                    PILImage, HAVE_PIL = Image, True
+                except Exception:
+                    HAVE_PIL = False
+    return PILImage
+
+def load_dicom():
+    global pydicom, HAVE_DICOM
+    if HAVE_DICOM is None:
+        with _lazy_lock:
+            if HAVE_DICOM is None:
+                try:
+                    import pydicom as _pydicom
+                    import numpy  # noqa: F401  (pixel_array needs it)
+                    pydicom, HAVE_DICOM = _pydicom, True
+                except Exception:
+                    HAVE_DICOM = False
+    return pydicom
 
 try:
-    import pydicom
-    import numpy as np
-    HAVE_DICOM = True
+    import zstandard
+    HAVE_ZSTD = True
 except Exception:
-    HAVE_DICOM = False
+    zstandard = None
+    HAVE_ZSTD = False
 
 # ---------- OpenAI client ----------
-proxy = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY")
-if proxy:
-    client = OpenAI(api_key=OPENAI_API_KEY,
-                    http_client=httpx.Client(proxies=proxy, timeout=60))
-else:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+# Built on first use; importing the openai SDK is a large part of cold-start time.
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lazy_lock:
+            if _client is None:
+                from openai import OpenAI
+                proxy = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY")
+                if proxy:
+                    import httpx
+                    _client = OpenAI(api_key=OPENAI_API_KEY,
+                                     http_client=httpx.Client(proxies=proxy, timeout=60))
+                else:
+                    _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
 
 # ---------- Database settings ----------
 DB_HOST = os.getenv("DB_HOST")
@@ -57,6 +98,10 @@ CORS(
     supports_credentials=False,
 )
 
+# Fast JSON (ISO datetimes) + gzip/brotli negotiation for JSON and HTML responses
+install_json(app)
+install_compression(app)
+
 
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -104,8 +149,34 @@ def get_connection():
         connection_timeout=10
     )
 
+ER_LOCK_DEADLOCK = 1213
+
+def run_in_transaction(write, attempts: int = 3):
+    """
+    Run write(cursor) and commit on a fresh connection. InnoDB rolls back the whole
+    transaction on a deadlock, so the whole write is retried rather than committing half.
+    """
+    for attempt in range(attempts):
+        conn = get_connection()
+        cursor = conn.cursor()
+        try:
+            result = write(cursor)
+            conn.commit()
+            return result
+        except mysql.connector.Error as e:
+            conn.rollback()
+            if e.errno != ER_LOCK_DEADLOCK or attempt == attempts - 1:
+                raise
+        finally:
+            cursor.close(); conn.close()
+
+_schema_ready = False
+
 def ensure_columns():
     """Idempotently add the async columns and composite index used by the worker."""
+    global _schema_ready
+    if _schema_ready:
+        return
     try:
         conn = get_connection()
         cur = conn.cursor()
@@ -119,11 +190,22 @@ def ensure_columns():
                 cur.execute(f"ALTER TABLE {table} ADD COLUMN {ddl}")
 
         # Columns our code relies on
+        add_col('clinical_analyses', 'doctor_id',           "doctor_id INT UNSIGNED NULL")
         add_col('clinical_analyses', 'status',              "status VARCHAR(20) NOT NULL DEFAULT 'completed'")
         add_col('clinical_analyses', 'images_json',         "images_json JSON NULL")
         add_col('clinical_analyses', 'detected_conditions', "detected_conditions JSON NULL")
         add_col('clinical_analyses', 'updated_at',          "updated_at TIMESTAMP NULL DEFAULT NULL")
         add_col('clinical_analyses', 'error_message',       "error_message TEXT NULL")
+        add_col('clinical_analyses', 'analysis_sections',   "analysis_sections JSON NULL")
+        add_col('clinical_analyses', 'search_conditions',   "search_conditions TEXT NULL")
+        add_col('clinical_analyses', 'images_z',            "images_z LONGBLOB NULL")
+        add_col('clinical_analyses', 'priority',            "priority TINYINT NOT NULL DEFAULT 0")
+        add_col('clinical_analyses', 'claimed_at',          "claimed_at TIMESTAMP NULL DEFAULT NULL")
+        add_col('clinical_analyses', 'claimed_by',          "claimed_by VARCHAR(128) NULL")
+        add_col('clinical_analyses', 'claim_token',         "claim_token CHAR(32) NULL")
+        add_col('clinical_analyses', 'partial_analysis',    "partial_analysis MEDIUMTEXT NULL")
+        add_col('clinical_analyses', 'progress_section',    "progress_section VARCHAR(64) NULL")
+        add_col('clinical_analyses', 'progress_tokens',     "progress_tokens INT UNSIGNED NULL")
 
         # Check if an index named idx_status_created exists
         cur.execute("""
@@ -165,7 +247,69 @@ def ensure_columns():
                 if e.errno != 1061:
                     raise
 
+        table_idx_cols = {'clinical_analyses': idx_cols}
+
+        def add_index(name, cols, kind="INDEX", table='clinical_analyses'):
+            if table not in table_idx_cols:
+                cur.execute("""
+                    SELECT INDEX_NAME, COLUMN_NAME
+                    FROM INFORMATION_SCHEMA.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME=%s
+                    ORDER BY INDEX_NAME, SEQ_IN_INDEX
+                """, (table,))
+                table_idx_cols[table] = {}
+                for idx_name, col_name in cur.fetchall():
+                    table_idx_cols[table].setdefault(idx_name, []).append(col_name)
+            if cols in table_idx_cols[table].values():
+                return
+            try:
+                cur.execute(f"ALTER TABLE {table} ADD {kind} {name} ({', '.join(cols)})")
+                table_idx_cols[table][name] = cols
+            except mysql.connector.Error as e:
+                if e.errno != 1061:
+                    raise
+
+        # Patient history lookups (keyset pagination walks this backwards)
+        add_index('idx_patient_created', ['patient_name', 'created_at'])
+
+        # Full-text search; JSON can't be FULLTEXT-indexed, so conditions are mirrored as text
+        # (older rows are filled in by fill_search_conditions)
+        add_index('ft_note_analysis', ['note', 'analysis', 'search_conditions'], kind="FULLTEXT INDEX")
+
+        # Job claims: DISTINCT (priority, doctor_id) is a loose index scan, and each
+        # per-doctor claim is a single index dive
+        add_index('idx_claim', ['status', 'priority', 'doctor_id', 'created_at'])
+        add_index('idx_claimed_at', ['claimed_at'])
+        add_index('idx_claim_token', ['claim_token'])
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS queue_doctor_service (
+                doctor_id INT UNSIGNED NOT NULL PRIMARY KEY,
+                last_claimed_at TIMESTAMP(6) NOT NULL
+            ) ENGINE=InnoDB
+        """)
+
+        # Archived note/analysis are compressed, so search reads a plain-text copy
+        cur.execute(ARCHIVE_TABLE_DDL)
+        # MySQL < 8.0 resets AUTO_INCREMENT to max(id)+1 on restart; keep new ids clear of archived ones
+        cur.execute("SELECT MAX(id) FROM clinical_analyses_archive")
+        max_archived = cur.fetchone()[0]
+        if max_archived:
+            cur.execute(f"ALTER TABLE clinical_analyses AUTO_INCREMENT = {int(max_archived) + 1}")
+        add_col('clinical_analyses_archive', 'search_text', "search_text MEDIUMTEXT NULL")
+        add_index('ft_archive_search', ['search_text', 'search_conditions'],
+                  kind="FULLTEXT INDEX", table='clinical_analyses_archive')
+        # One-off data migrations the archiver has finished
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS app_maintenance (
+                name VARCHAR(64) NOT NULL PRIMARY KEY,
+                completed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+            ) ENGINE=InnoDB
+        """)
+        for ddl in ROLLUP_TABLES_DDL:
+            cur.execute(ddl)
+
         conn.commit()
+        _schema_ready = True
     except Exception as e:
         # Keep running even if schema tweak failed; just log once.
         print("ensure_columns error (non-fatal):", e)
@@ -176,6 +320,94 @@ def ensure_columns():
             pass
 
 
+# ---------- Compressed storage ----------
+# Blob columns start with a 2-byte format marker so the codec can change without a migration.
+BLOB_RAW, BLOB_ZLIB, BLOB_ZSTD = b"r0", b"z1", b"s1"
+BLOB_CODEC = os.getenv("BLOB_CODEC", "zstd" if HAVE_ZSTD else "zlib")
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "512"))
+
+def pack_text(text):
+    if text is None:
+        return None
+    raw = text.encode("utf-8")
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return BLOB_RAW + raw
+    if BLOB_CODEC == "zstd" and HAVE_ZSTD:
+        return BLOB_ZSTD + zstandard.ZstdCompressor(level=6).compress(raw)
+    return BLOB_ZLIB + zlib.compress(raw, 6)
+
+def unpack_text(blob):
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    marker, body = blob[:2], blob[2:]
+    if marker == BLOB_ZLIB:
+        return zlib.decompress(body).decode("utf-8")
+    if marker == BLOB_ZSTD:
+        if not HAVE_ZSTD:
+            raise RuntimeError("zstd-compressed row but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(body).decode("utf-8")
+    if marker == BLOB_RAW:
+        return body.decode("utf-8")
+    raise ValueError(f"Unknown blob format marker {marker!r}")
+
+def pack_images(images_data_uris):
+    return pack_text(json.dumps(images_data_uris or []))
+
+def unpack_images(record: dict) -> list:
+    """images_z (compressed) wins; images_json is the pre-compression layout."""
+    try:
+        if record.get("images_z") is not None:
+            return json.loads(unpack_text(record["images_z"]))
+        return json.loads(record["images_json"]) if record.get("images_json") else []
+    except Exception:
+        return []
+
+ARCHIVE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS clinical_analyses_archive (
+        id INT UNSIGNED NOT NULL PRIMARY KEY,
+        doctor_id INT UNSIGNED NULL,
+        patient_name VARCHAR(255) NULL,
+        specialty VARCHAR(100) NULL,
+        status VARCHAR(20) NOT NULL,
+        note_z LONGBLOB NULL,
+        analysis_z LONGBLOB NULL,
+        images_z LONGBLOB NULL,
+        analysis_sections JSON NULL,
+        detected_conditions JSON NULL,
+        search_conditions TEXT NULL,
+        search_text MEDIUMTEXT NULL,
+        error_message TEXT NULL,
+        created_at TIMESTAMP NULL DEFAULT NULL,
+        updated_at TIMESTAMP NULL DEFAULT NULL,
+        archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_patient_created (patient_name, created_at),
+        FULLTEXT INDEX ft_archive_search (search_text, search_conditions)
+    ) ENGINE=InnoDB
+"""
+
+ROLLUP_TABLES_DDL = [
+    # One row per (day, dimension value, status); dimension is all/specialty/doctor/condition
+    """
+    CREATE TABLE IF NOT EXISTS analytics_daily (
+        day DATE NOT NULL,
+        dimension VARCHAR(16) NOT NULL,
+        dim_value VARCHAR(128) NOT NULL,
+        status VARCHAR(20) NOT NULL,
+        n INT UNSIGNED NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, dimension, dim_value, status)
+    ) ENGINE=InnoDB
+    """,
+    # Log-bucketed model latency histogram per day; percentiles are read off the buckets
+    """
+    CREATE TABLE IF NOT EXISTS analytics_latency_daily (
+        day DATE NOT NULL,
+        bucket SMALLINT NOT NULL,
+        n INT UNSIGNED NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, bucket)
+    ) ENGINE=InnoDB
+    """,
+]
 
 def get_prompt_modifier(specialty_slug: str) -> str:
     try:
@@ -210,19 +442,19 @@ def image_file_to_png_bytes(fstorage) -> tuple[bytes, str]:
 
     # DICOM → PNG
     if ext in ('dcm', 'dicom'):
-        if not HAVE_DICOM:
+        if load_dicom() is None:
             raise RuntimeError("DICOM support not available on server")
         ds = pydicom.dcmread(io.BytesIO(raw))
         arr = ds.pixel_array.astype('float32')
         arr = 255*(arr - arr.min()) / max(1e-6, (arr.max() - arr.min()))
         arr = arr.astype('uint8')
-        if not HAVE_PIL or PILImage is None:
+        if load_pil() is None:
             raise RuntimeError("Pillow not available to encode PNG")
         im = PILImage.fromarray(arr, mode='L')
         return pil_to_png_bytes(im), "dicom"
 
     # Standard image → PNG
-    if not HAVE_PIL or PILImage is None:
+    if load_pil() is None:
         raise RuntimeError("Pillow not available on server")
     im = PILImage.open(io.BytesIO(raw))
     return pil_to_png_bytes(im), "image"
@@ -276,20 +508,12 @@ def build_prompt(note: str, specialty: str, images_meta_text: str, detected_cond
         f"\n### SPECIAL GUIDANCE: {cond.upper()}\n{GUIDANCE_DATA[cond]['prompt']}"
         for cond in detected_conditions
     )
+    sections_text = "\n".join(f"{i}. {title}" for i, (_, title) in enumerate(ANALYSIS_SECTIONS, 1))
 
     prompt_text = f"""You are a highly trained clinical decision support AI.
 Analyze the clinical case below and return structured diagnostic reasoning using these 10 sections:
 
-1. Differential Diagnosis
-2. Pathophysiology Integration
-3. Diagnostic Workup
-4. Treatment and Medications
-5. Risk Stratification & Clinical Judgment
-6. Management of Chronic Conditions
-7. Infection Consideration & Antibiotics
-8. Disposition & Follow-Up
-9. Red Flags or Missed Diagnoses
-10. Clinical Guidelines Integration
+{sections_text}
 
 {modifier}
 
@@ -303,6 +527,9 @@ IMAGE METADATA:
 """
     return prompt_text
 
+def conditions_search_text(detected_conditions) -> str:
+    return " ".join(detected_conditions or [])
+
 def detect_conditions(note: str):
     lower_note = (note or "").lower()
     return [
@@ -310,7 +537,13 @@ def detect_conditions(note: str):
         if any(trigger in lower_note for trigger in data["triggers"])
     ]
 
-def run_gpt5_analysis(note: str, specialty: str, images_data_uris: list, filenames_meta: list):
+def run_gpt5_analysis(note: str, specialty: str, images_data_uris: list, filenames_meta: list,
+                      on_token=None):
+    """
+    Run the analysis. With on_token, the response is streamed and on_token(text) is
+    called for every delta; if streaming fails before any output, falls back to a
+    single blocking call.
+    """
     detected_conditions = detect_conditions(note)
     prompt_text = build_prompt(
         note=note,
@@ -324,13 +557,33 @@ def run_gpt5_analysis(note: str, specialty: str, images_data_uris: list, filenam
     for uri in images_data_uris:
         content_blocks.append({"type": "image_url", "image_url": {"url": uri}})
 
-    resp = client.chat.completions.create(
+    messages = [
+        {"role": "system", "content": "You are a medical expert that returns only formatted diagnostic analysis."},
+        {"role": "user", "content": content_blocks}
+    ]
+
+    if on_token is not None:
+        parts = []
+        try:
+            stream = get_client().chat.completions.create(model="gpt-5", messages=messages, stream=True)
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                token = getattr(chunk.choices[0].delta, "content", None) or ""
+                if token:
+                    parts.append(token)
+                    on_token(token)
+        except Exception as e:
+            if parts:
+                raise
+            print("[worker] streaming unavailable, falling back to blocking call:", e)
+        if parts:
+            return "".join(parts).strip(), detected_conditions
+
+    resp = get_client().chat.completions.create(
         model="gpt-5",
         #model="gpt-4o",
-        messages=[
-            {"role": "system", "content": "You are a medical expert that returns only formatted diagnostic analysis."},
-            {"role": "user", "content": content_blocks}
-        ],
+        messages=messages,
     )
     full_response = resp.choices[0].message.content.strip()
     return full_response, detected_conditions
@@ -352,42 +605,53 @@ def analyze():
         if request.files:
             note = (request.form.get("note") or "").strip()
             specialty = request.form.get("specialty", "general")
-            for idx, f in enumerate(request.files.getlist("images")):
-                if idx >= MAX_IMAGES or not file_ok(f.filename):
-                    continue
-                try:
-                    png_bytes, kind = image_file_to_png_bytes(f)
-                    images_data_uris.append(b64_data_uri(png_bytes))
-                    filenames_meta.append(f"{f.filename} ({kind})")
-                except Exception as ex:
-                    filenames_meta.append(f"{f.filename} (error: {ex})")
+            doctor_id = request.form.get("doctor_id") or None
         else:
             data = request.get_json(silent=True) or {}
             note = (data.get("note") or "").strip()
             specialty = data.get("specialty", "general")
+            doctor_id = data.get("doctor_id")
 
         if not note:
             return jsonify({"error": "Missing clinical note"}), 400
 
         patient_name = note.split(",")[0].strip() if "," in note else "Unknown"
 
-        # Run GPT-5 (blocking)
-        analysis, detected = run_gpt5_analysis(note, specialty, images_data_uris, filenames_meta)
+        # Take a synchronous slot before any image decoding, so rejected requests stay cheap
+        slot = ANALYZE_LIMITER.acquire(doctor_id)
+        if not slot.ok:
+            return too_busy(slot.scope, slot.retry_after, "synchronous analyses")
+        try:
+            for idx, f in enumerate(request.files.getlist("images")):
+                if idx >= MAX_IMAGES or not file_ok(f.filename):
+                    continue
+                try:
+                    png_bytes, kind = image_file_to_png_bytes(f)
+                    images_data_uris.append(b64_data_uri(png_bytes))
+                    filenames_meta.append(f"{f.filename} ({kind})")
+                except Exception as ex:
+                    filenames_meta.append(f"{f.filename} (error: {ex})")
+
+            # Run GPT-5 (blocking)
+            started = time.monotonic()
+            analysis, detected = run_gpt5_analysis(note, specialty, images_data_uris, filenames_meta)
+            latency_ms = (time.monotonic() - started) * 1000
+        finally:
+            slot.release()
 
         # Save to DB
-        try:
-            conn = get_connection()
-            cursor = conn.cursor()
+        def save(cursor):
             cursor.execute("""
-                INSERT INTO clinical_analyses (patient_name, specialty, note, analysis, status, images_json, detected_conditions, created_at)
-                VALUES (%s, %s, %s, %s, 'completed', %s, %s, CURRENT_TIMESTAMP)
-            """, (patient_name, specialty, note, analysis, json.dumps(images_data_uris or []), json.dumps(detected)))
-            conn.commit()
-        finally:
-            try:
-                cursor.close(); conn.close()
-            except:
-                pass
+                INSERT INTO clinical_analyses (doctor_id, patient_name, specialty, note, analysis, analysis_sections, status, images_z, detected_conditions, search_conditions, created_at)
+                VALUES (%s, %s, %s, %s, %s, %s, 'completed', %s, %s, %s, CURRENT_TIMESTAMP)
+            """, (doctor_id, patient_name, specialty, note, analysis, json.dumps(parse_sections(analysis)),
+                  pack_images(images_data_uris), json.dumps(detected), conditions_search_text(detected)))
+            # Roll up under MySQL's date for the row, as run_job() and backfill_rollups() do
+            cursor.execute("SELECT DATE(created_at) FROM clinical_analyses WHERE id = %s", (cursor.lastrowid,))
+            day = cursor.fetchone()[0]
+            record_rollup(cursor, day, 'completed', specialty, doctor_id, detected, latency_ms)
+
+        run_in_transaction(save)
 
         return jsonify({
             "full_response": analysis,
@@ -400,6 +664,46 @@ def analyze():
         return jsonify({"error": str(e)}), 500
 
 # ---- Async queue endpoint ----
+MAX_PENDING = env_limit("MAX_PENDING", 500)
+MAX_PENDING_PER_DOCTOR = env_limit("MAX_PENDING_PER_DOCTOR", 50)
+
+def queue_usage(doctor_id=None) -> dict:
+    """Pending depth (global and for one doctor) and the claim rate over the drain window."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT COUNT(*) FROM clinical_analyses WHERE status = 'pending'")
+    pending = cur.fetchone()[0]
+    doctor_pending = None
+    if doctor_id not in (None, ""):
+        cur.execute("SELECT COUNT(*) FROM clinical_analyses WHERE status = 'pending' AND doctor_id = %s",
+                    (doctor_id,))
+        doctor_pending = cur.fetchone()[0]
+    cur.execute("""
+        SELECT COUNT(*) FROM clinical_analyses
+        WHERE claimed_at >= NOW() - INTERVAL %s SECOND
+    """, (DRAIN_WINDOW_SECONDS,))
+    claimed = cur.fetchone()[0]
+    cur.close(); conn.close()
+    return {"pending": pending, "doctor_pending": doctor_pending,
+            "drain_rate_per_s": claimed / DRAIN_WINDOW_SECONDS}
+
+def queue_admission(doctor_id):
+    """None if the job may be queued, else a 429/503 response with Retry-After."""
+    if not MAX_PENDING and not MAX_PENDING_PER_DOCTOR:
+        return None
+    usage = queue_usage(doctor_id)
+    rate = usage["drain_rate_per_s"]
+    if MAX_PENDING and usage["pending"] >= MAX_PENDING:
+        excess = usage["pending"] - MAX_PENDING + 1
+        return too_busy("global", retry_after_from_rate(excess, rate), "queued analyses")
+    doctor_pending = usage["doctor_pending"]
+    if MAX_PENDING_PER_DOCTOR and doctor_pending is not None and doctor_pending >= MAX_PENDING_PER_DOCTOR:
+        # Round-robin claims give each waiting doctor roughly an equal share of the drain rate
+        excess = doctor_pending - MAX_PENDING_PER_DOCTOR + 1
+        share = rate * doctor_pending / max(1, usage["pending"])
+        return too_busy("doctor", retry_after_from_rate(excess, share), "queued analyses")
+    return None
+
 @app.route('/queue_analysis', methods=['POST'])
 def queue_analysis():
     """
@@ -414,67 +718,163 @@ def queue_analysis():
         if request.files:
             note = (request.form.get("note") or "").strip()
             specialty = request.form.get("specialty", "general")
-            for idx, f in enumerate(request.files.getlist("images")):
-                if idx >= MAX_IMAGES or not file_ok(f.filename):
-                    continue
-                try:
-                    png_bytes, kind = image_file_to_png_bytes(f)
-                    images_data_uris.append(b64_data_uri(png_bytes))
-                    filenames_meta.append(f"{f.filename} ({kind})")
-                except Exception as ex:
-                    filenames_meta.append(f"{f.filename} (error: {ex})")
+            doctor_id = request.form.get("doctor_id") or None
+            requested_priority = request.form.get("priority")
         else:
             data = request.get_json(silent=True) or {}
             note = (data.get("note") or "").strip()
             specialty = data.get("specialty", "general")
             doctor_id = data.get("doctor_id")  # may be None
+            requested_priority = data.get("priority")
 
         if not note:
             return jsonify({"error": "Missing clinical note"}), 400
 
         patient_name = note.split(",")[0].strip() if "," in note else "Unknown"
+        priority = job_priority(note, requested_priority)
 
+        # Check queue depth before any image decoding, so rejected requests stay cheap
         ensure_columns()
+        rejected = queue_admission(doctor_id)
+        if rejected:
+            return rejected
+
+        for idx, f in enumerate(request.files.getlist("images")):
+            if idx >= MAX_IMAGES or not file_ok(f.filename):
+                continue
+            try:
+                png_bytes, kind = image_file_to_png_bytes(f)
+                images_data_uris.append(b64_data_uri(png_bytes))
+                filenames_meta.append(f"{f.filename} ({kind})")
+            except Exception as ex:
+                filenames_meta.append(f"{f.filename} (error: {ex})")
+
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO clinical_analyses (doctor_id, patient_name, specialty, note, status, images_json, created_at)
-            VALUES (%s, %s, %s, %s, 'pending', %s, CURRENT_TIMESTAMP)
-        """, (doctor_id, patient_name, specialty, note, json.dumps(images_data_uris or [])))
+            INSERT INTO clinical_analyses (doctor_id, patient_name, specialty, note, status, priority, images_z, created_at)
+            VALUES (%s, %s, %s, %s, 'pending', %s, %s, CURRENT_TIMESTAMP)
+        """, (doctor_id, patient_name, specialty, note, priority, pack_images(images_data_uris)))
         analysis_id = cursor.lastrowid
         conn.commit()
         cursor.close(); conn.close()
 
-        return jsonify({"analysis_id": analysis_id, "status": "pending"})
+        return jsonify({"analysis_id": analysis_id, "status": "pending", "priority": PRIORITY_NAMES[priority]})
 
     except Exception as e:
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 # ---- Async status fetch ----
+def fetch_archived_records(ids: list) -> dict:
+    """Look up rows the archiver has moved out of clinical_analyses, decompressing their blobs."""
+    if not ids:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"""
+        SELECT id, doctor_id, patient_name, specialty, status, note_z, analysis_z, images_z,
+               analysis_sections, detected_conditions, created_at, updated_at
+        FROM clinical_analyses_archive WHERE id IN ({', '.join(['%s'] * len(ids))})
+    """, tuple(ids))
+    rows = cursor.fetchall()
+    cursor.close(); conn.close()
+    records = {}
+    for r in rows:
+        r["note"] = unpack_text(r.pop("note_z"))
+        r["analysis"] = unpack_text(r.pop("analysis_z"))
+        r["images_json"] = unpack_images(r)
+        r.pop("images_z", None)
+        r["archived"] = True
+        records[r["id"]] = r
+    return records
+
+def section_select_sql(keys: list) -> str:
+    """
+    Column list that pulls only the requested sections out of analysis_sections.
+    The full analysis blob is only read for legacy rows that have no section index yet.
+    """
+    cols = [
+        f"JSON_UNQUOTE(JSON_EXTRACT(analysis_sections, '$.{key}')) AS sec_{key}"
+        for key in keys
+    ]
+    # While a job is processing, sections come from the streamed partial text
+    cols.append("CASE WHEN analysis_sections IS NULL THEN "
+                "IF(status = 'processing', COALESCE(analysis, partial_analysis), analysis) END AS analysis")
+    return ", ".join(cols)
+
+def collect_sections(record: dict, keys: list) -> dict:
+    if record.get("analysis") is not None:
+        parsed = parse_sections(record.pop("analysis"))
+        for key in keys:
+            record.pop(f"sec_{key}", None)
+        return {key: parsed.get(key) for key in keys}
+    record.pop("analysis", None)
+    return {key: record.pop(f"sec_{key}", None) for key in keys}
+
 @app.route('/get_analysis', methods=['GET'])
 def get_analysis():
     analysis_id = request.args.get("id")
     if not analysis_id:
         return jsonify({"error": "Missing analysis ID"}), 400
+    try:
+        analysis_id = int(analysis_id)
+    except ValueError:
+        return jsonify({"error": "id must be an integer"}), 400
+    section_keys = resolve_section_keys(request.args.get("sections"))
+    if request.args.get("sections") and not section_keys:
+        return jsonify({"error": "Unknown section(s)", "available": SECTION_KEYS}), 400
     try:
         ensure_columns()
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT id, patient_name, specialty, note, analysis, status, images_json, detected_conditions, created_at, updated_at
-            FROM clinical_analyses WHERE id = %s
-        """, (analysis_id,))
+        if section_keys:
+            # Partial fetch: skip note / images / full analysis
+            cursor.execute(f"""
+                SELECT id, patient_name, specialty, status, detected_conditions, created_at, updated_at,
+                       progress_section, progress_tokens, {section_select_sql(section_keys)}
+                FROM clinical_analyses WHERE id = %s
+            """, (analysis_id,))
+        else:
+            cursor.execute("""
+                SELECT id, patient_name, specialty, note,
+                       IF(status = 'processing', COALESCE(analysis, partial_analysis), analysis) AS analysis, status,
+                       images_json, images_z, detected_conditions, created_at, updated_at,
+                       progress_section, progress_tokens
+                FROM clinical_analyses WHERE id = %s
+            """, (analysis_id,))
         record = cursor.fetchone()
         cursor.close(); conn.close()
-        if not record:
-            return jsonify({"error": "Analysis not found"}), 404
 
-        # decode JSON columns for neatness
-        try:
-            record["images_json"] = json.loads(record["images_json"]) if record["images_json"] else []
-        except Exception:
-            record["images_json"] = []
+        if record:
+            section = record.pop("progress_section", None)
+            tokens = record.pop("progress_tokens", None)
+            if record["status"] == "processing":
+                # analysis holds the partial text streamed so far
+                record["progress"] = {
+                    "section": section,
+                    "section_index": SECTION_KEYS.index(section) + 1 if section in SECTION_KEYS else 0,
+                    "sections_total": len(SECTION_KEYS),
+                    "tokens": tokens or 0,
+                }
+            if section_keys:
+                record["sections"] = collect_sections(record, section_keys)
+            else:
+                # decode image blob / JSON for neatness
+                record["images_json"] = unpack_images(record)
+                record.pop("images_z", None)
+        else:
+            # Older rows may have been moved to the archive table
+            record = fetch_archived_records([analysis_id]).get(analysis_id)
+            if not record:
+                return jsonify({"error": "Analysis not found"}), 404
+            sections = load_sections(record)
+            record.pop("analysis_sections", None)
+            if section_keys:
+                for col in ("note", "analysis", "images_json"):
+                    record.pop(col, None)
+                record["sections"] = {key: sections.get(key) for key in section_keys}
+
         try:
             record["detected_conditions"] = json.loads(record["detected_conditions"]) if record["detected_conditions"] else []
         except Exception:
@@ -484,147 +884,1034 @@ def get_analysis():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ---------- Analytics rollups ----------
+# Bucket b holds latencies in [LATENCY_BUCKET_BASE**b, LATENCY_BUCKET_BASE**(b+1)) ms,
+# and percentiles report the bucket's upper edge (at most 20% above the true value).
+LATENCY_BUCKET_BASE = 1.2
+
+def latency_bucket(ms: float) -> int:
+    return int(math.log(max(ms, 1.0), LATENCY_BUCKET_BASE))
+
+def rollup_rows(day, status, specialty, doctor_id, conditions) -> list:
+    rows = [(day, "all", "", status)]
+    rows.append((day, "specialty", (specialty or "general")[:128], status))
+    if doctor_id not in (None, ""):
+        rows.append((day, "doctor", str(doctor_id), status))
+    rows.extend((day, "condition", c[:128], status) for c in set(conditions or []))
+    return rows
+
+def record_rollup(cursor, day, status, specialty, doctor_id, conditions, latency_ms=None):
+    """
+    Add one finished job to the daily rollups. Call it on the cursor that writes the
+    job's final status so both commit together. A rollup error is rolled back to a
+    savepoint and logged, so the status write still commits (backfill_rollups() can
+    repair counts). A deadlock has already rolled back the whole transaction, so it is
+    re-raised for run_in_transaction() to retry.
+    """
+    day = day or date.today()
+    cursor.execute("SAVEPOINT rollup")
+    try:
+        cursor.executemany("""
+            INSERT INTO analytics_daily (day, dimension, dim_value, status, n)
+            VALUES (%s, %s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE n = n + 1
+        """, rollup_rows(day, status, specialty, doctor_id, conditions))
+        if latency_ms is not None:
+            cursor.execute("""
+                INSERT INTO analytics_latency_daily (day, bucket, n) VALUES (%s, %s, 1)
+                ON DUPLICATE KEY UPDATE n = n + 1
+            """, (day, latency_bucket(latency_ms)))
+        cursor.execute("RELEASE SAVEPOINT rollup")
+    except mysql.connector.Error as e:
+        if e.errno == ER_LOCK_DEADLOCK:
+            raise
+        cursor.execute("ROLLBACK TO SAVEPOINT rollup")
+        print("rollup update failed (non-fatal):", e)
+
+def backfill_rollups(since: date | None = None, batch_size: int = 5000) -> dict:
+    """
+    Rebuild the rollups from clinical_analyses and the archive (from `since`, or everything).
+    Historical model latency is approximated by updated_at - claimed_at for queued jobs.
+    Conditions come from detected_conditions, as in record_rollup(); rows without it (jobs
+    that failed) are re-detected from the note, as run_job() does when recording a failure.
+    """
+    counts, latency = {}, {}
+    for table, extra in (
+        ("clinical_analyses", "claimed_at, IF(detected_conditions IS NULL, note, NULL) AS note"),
+        ("clinical_analyses_archive", "NULL AS claimed_at, IF(detected_conditions IS NULL, note_z, NULL) AS note_z"),
+    ):
+        last_id = 0
+        while True:
+            conn = get_connection()
+            cur = conn.cursor(dictionary=True)
+            cur.execute(f"""
+                SELECT id, DATE(created_at) AS day, status, specialty, doctor_id, detected_conditions,
+                       {extra}, updated_at
+                FROM {table}
+                WHERE id > %s AND status IN ('completed', 'failed') AND created_at IS NOT NULL
+                  AND (%s IS NULL OR created_at >= %s)
+                ORDER BY id LIMIT %s
+            """, (last_id, since, since, batch_size))
+            rows = cur.fetchall()
+            cur.close(); conn.close()
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            for r in rows:
+                if r["detected_conditions"] is not None:
+                    try:
+                        conditions = json.loads(r["detected_conditions"])
+                    except (TypeError, ValueError):
+                        conditions = []
+                else:
+                    note = r["note"] if "note" in r else unpack_text(r["note_z"])
+                    conditions = detect_conditions(note)
+                for key in rollup_rows(r["day"], r["status"], r["specialty"], r["doctor_id"], conditions):
+                    counts[key] = counts.get(key, 0) + 1
+                if r["status"] == "completed" and r["claimed_at"] and r["updated_at"]:
+                    ms = (r["updated_at"] - r["claimed_at"]).total_seconds() * 1000
+                    key = (r["day"], latency_bucket(ms))
+                    latency[key] = latency.get(key, 0) + 1
+
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        conn.start_transaction()
+        cur.execute("DELETE FROM analytics_daily WHERE %s IS NULL OR day >= %s", (since, since))
+        cur.execute("DELETE FROM analytics_latency_daily WHERE %s IS NULL OR day >= %s", (since, since))
+        if counts:
+            cur.executemany("""
+                INSERT INTO analytics_daily (day, dimension, dim_value, status, n) VALUES (%s, %s, %s, %s, %s)
+            """, [(*key, n) for key, n in counts.items()])
+        if latency:
+            cur.executemany("""
+                INSERT INTO analytics_latency_daily (day, bucket, n) VALUES (%s, %s, %s)
+            """, [(*key, n) for key, n in latency.items()])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close(); conn.close()
+    return {"rollup_rows": len(counts), "latency_buckets": len(latency)}
+
+def latency_percentiles(buckets: dict, pcts=(50, 90, 95, 99)) -> dict:
+    """Percentiles (upper bucket edge, ms) from a {bucket: count} histogram."""
+    total = sum(buckets.values())
+    out = {"count": total}
+    if not total:
+        return out
+    ordered = sorted(buckets.items())
+    for pct in pcts:
+        target, seen = math.ceil(total * pct / 100), 0
+        for bucket, n in ordered:
+            seen += n
+            if seen >= target:
+                out[f"p{pct}"] = round(LATENCY_BUCKET_BASE ** (bucket + 1))
+                break
+    return out
+
 # ---------- Background worker ----------
-def process_pending_jobs():
+PARTIAL_FLUSH_SECONDS = float(os.getenv("PARTIAL_FLUSH_SECONDS", "2"))
+PARTIAL_FLUSH_BYTES = int(os.getenv("PARTIAL_FLUSH_BYTES", "1024"))
+
+def make_partial_writer(analysis_id, claim_token=None):
+    """
+    on_token callback for run_gpt5_analysis that writes the text so far to
+    partial_analysis, at most every PARTIAL_FLUSH_SECONDS or PARTIAL_FLUSH_BYTES,
+    for as long as this worker still holds the claim.
+    A failed write is logged and retried on the next flush; it never fails the job.
+    """
+    parts = []
+    state = {"tokens": 0, "unflushed": 0, "last_flush": time.monotonic()}
+
+    def on_token(token: str):
+        parts.append(token)
+        state["tokens"] += 1
+        state["unflushed"] += len(token)
+        if (state["unflushed"] < PARTIAL_FLUSH_BYTES
+                and time.monotonic() - state["last_flush"] < PARTIAL_FLUSH_SECONDS):
+            return
+        text = "".join(parts)
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE clinical_analyses
+                SET partial_analysis = %s, progress_section = %s, progress_tokens = %s,
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'processing' AND claim_token <=> %s
+            """, (text, current_section(text), state["tokens"], analysis_id, claim_token))
+            conn.commit()
+            cursor.close(); conn.close()
+            state["unflushed"] = 0
+        except Exception as e:
+            print(f"[worker] partial write failed for {analysis_id}:", e)
+        state["last_flush"] = time.monotonic()
+
+    on_token.state = state
+    return on_token
+
+JOB_COLUMNS = "id, doctor_id, priority, patient_name, specialty, note, images_json, images_z, created_at, claim_token"
+FAIR_CANDIDATES = 20   # (priority, doctor) groups tried per claim before giving up
+CLAIM_BATCH = max(1, int(os.getenv("CLAIM_BATCH", "1")))
+# auto | skip_locked | update. "update" claims with a single atomic UPDATE ... LIMIT n and
+# reads rows back by claim token, for servers without SKIP LOCKED (bench_claims.py compares them).
+CLAIM_STRATEGY = os.getenv("CLAIM_STRATEGY", "auto")
+# A claim still 'processing' this long after its last write belongs to a dead worker
+# (partial writes refresh updated_at while a job streams). 0 disables the sweep.
+STALE_CLAIM_SECONDS = int(os.getenv("STALE_CLAIM_SECONDS", "1800"))
+
+def worker_id(pid: int | None = None) -> str:
+    return f"{socket.gethostname()}:{pid or os.getpid()}"
+
+WORKER_ID = worker_id()
+
+_claim_strategy = None
+
+def server_supports_skip_locked(version: str) -> bool:
+    """MySQL >= 8.0.1 and MariaDB >= 10.6 support FOR UPDATE SKIP LOCKED."""
+    nums = [int(n) for n in re.findall(r"\d+", version.split("-")[0])[:3]] + [0, 0, 0]
+    if "mariadb" in version.lower():
+        return tuple(nums[:2]) >= (10, 6)
+    return tuple(nums[:3]) >= (8, 0, 1)
+
+def claim_strategy() -> str:
+    """Resolved once per process; the server version doesn't change under us."""
+    global _claim_strategy
+    if _claim_strategy is None:
+        if CLAIM_STRATEGY in ("skip_locked", "update"):
+            _claim_strategy = CLAIM_STRATEGY
+        else:
+            conn = get_connection()
+            cur = conn.cursor()
+            cur.execute("SELECT VERSION()")
+            version = cur.fetchone()[0]
+            cur.close(); conn.close()
+            _claim_strategy = "skip_locked" if server_supports_skip_locked(version) else "update"
+            print(f"[worker] MySQL {version}: claim strategy {_claim_strategy}")
+    return _claim_strategy
+
+def claim_jobs(cursor, limit: int = 1, strategy: str | None = None) -> list:
+    """
+    Claim up to `limit` pending jobs inside the caller's transaction and mark them processing.
+    Highest priority first; within a priority, the doctor served least recently
+    goes next (round-robin across doctor_id), oldest job first for that doctor.
+    The caller records the served doctors after commit (see claim_batch).
+    """
+    strategy = strategy or claim_strategy()
+    cursor.execute("""
+        SELECT q.priority, q.doctor_id
+        FROM (SELECT DISTINCT priority, doctor_id
+              FROM clinical_analyses WHERE status = 'pending') q
+        LEFT JOIN queue_doctor_service s ON s.doctor_id = COALESCE(q.doctor_id, 0)
+        ORDER BY q.priority DESC, s.last_claimed_at IS NOT NULL, s.last_claimed_at ASC
+        LIMIT %s
+    """, (FAIR_CANDIDATES,))
+    groups = cursor.fetchall()
+
+    jobs = []
+    for group in groups:
+        want = limit - len(jobs)
+        if want <= 0:
+            break
+        token = uuid.uuid4().hex
+        if strategy == "skip_locked":
+            cursor.execute(f"""
+                SELECT {JOB_COLUMNS}
+                FROM clinical_analyses
+                WHERE status = 'pending' AND priority = %s AND doctor_id <=> %s
+                ORDER BY created_at ASC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (group["priority"], group["doctor_id"], want))
+            ids = [row["id"] for row in cursor.fetchall()]
+            if not ids:
+                continue
+            cursor.execute(f"""
+                UPDATE clinical_analyses
+                SET status = 'processing', claimed_by = %s, claim_token = %s,
+                    claimed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP, error_message = NULL
+                WHERE id IN ({', '.join(['%s'] * len(ids))})
+            """, (WORKER_ID, token, *ids))
+        else:
+            # A row another claimer has flipped but not yet committed still reads as
+            # 'pending', so this UPDATE waits for that commit, then skips the row.
+            # claim_batch keeps that transaction to the claim itself so the wait is short.
+            cursor.execute("""
+                UPDATE clinical_analyses
+                SET status = 'processing', claimed_by = %s, claim_token = %s,
+                    claimed_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP, error_message = NULL
+                WHERE status = 'pending' AND priority = %s AND doctor_id <=> %s
+                ORDER BY created_at ASC
+                LIMIT %s
+            """, (WORKER_ID, token, group["priority"], group["doctor_id"], want))
+            if not cursor.rowcount:
+                continue
+        cursor.execute(f"""
+            SELECT {JOB_COLUMNS} FROM clinical_analyses
+            WHERE claim_token = %s ORDER BY created_at ASC
+        """, (token,))
+        jobs.extend(cursor.fetchall())
+    return jobs
+
+def mark_doctors_served(cursor, jobs: list):
+    """Advance the round-robin for the doctors whose jobs were just claimed."""
+    # Sorted so concurrent upserts take the row locks in the same order
+    doctors = sorted({job["doctor_id"] or 0 for job in jobs})
+    if not doctors:
+        return
+    cursor.execute(f"""
+        INSERT INTO queue_doctor_service (doctor_id, last_claimed_at)
+        VALUES {', '.join(['(%s, NOW(6))'] * len(doctors))}
+        ON DUPLICATE KEY UPDATE last_claimed_at = NOW(6)
+    """, tuple(doctors))
+
+def claim_batch(conn, limit: int = CLAIM_BATCH, strategy: str | None = None) -> list:
+    """
+    Claim jobs in a short READ COMMITTED transaction, then update queue_doctor_service
+    in its own transaction. READ COMMITTED drops the gap locks REPEATABLE READ takes on
+    the scanned idx_claim range, so claims don't block /queue_analysis inserts, and the
+    hot queue_doctor_service rows are no longer locked for the whole claim.
+    """
+    conn.start_transaction(isolation_level="READ COMMITTED")
+    cursor = conn.cursor(dictionary=True)
+    try:
+        jobs = claim_jobs(cursor, limit, strategy)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        cursor.close()
+        raise
+    if jobs:
+        # Bookkeeping only: a failure here must not lose the claimed jobs
+        try:
+            mark_doctors_served(cursor, jobs)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print("[worker] failed to update queue_doctor_service:", e)
+    cursor.close()
+    return jobs
+
+def requeue_claims(condition: str, params: tuple) -> int:
+    """Put 'processing' rows matching `condition` back to pending, dropping any partial output."""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        UPDATE clinical_analyses
+        SET status = 'pending', claimed_by = NULL, claim_token = NULL, claimed_at = NULL,
+            partial_analysis = NULL, progress_section = NULL, progress_tokens = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE status = 'processing' AND {condition}
+    """, params)
+    n = cursor.rowcount
+    conn.commit()
+    cursor.close(); conn.close()
+    return n
+
+def requeue_worker_claims(worker_ids: list) -> int:
+    """Requeue jobs held by worker processes known to be dead (e.g. killed after a drain timeout)."""
+    if not worker_ids:
+        return 0
+    return requeue_claims(f"claimed_by IN ({', '.join(['%s'] * len(worker_ids))})", tuple(worker_ids))
+
+def requeue_stale_claims(older_than: int = STALE_CLAIM_SECONDS) -> int:
+    """Requeue claims with no write for `older_than` seconds, whoever held them."""
+    if older_than <= 0:
+        return 0
+    return requeue_claims("updated_at < NOW() - INTERVAL %s SECOND", (older_than,))
+
+def run_job(job):
+    """Run one claimed job and record it as completed or failed."""
+    print(f"[worker] Processing analysis {job['id']}...")
+
+    # --- do the work ---
+    try:
+        images_data_uris = unpack_images(job)
+        filenames_meta = [f"image_{i+1}.png (queued)" for i in range(len(images_data_uris))]
+
+        on_token = make_partial_writer(job['id'], job['claim_token'])
+        started = time.monotonic()
+        analysis_result, detected = run_gpt5_analysis(
+            note=job['note'],
+            specialty=job['specialty'],
+            images_data_uris=images_data_uris,
+            filenames_meta=filenames_meta,
+            on_token=on_token
+        )
+        latency_ms = (time.monotonic() - started) * 1000
+
+        def complete(cursor):
+            cursor.execute("""
+                UPDATE clinical_analyses
+                SET analysis = %s,
+                    analysis_sections = %s,
+                    status = 'completed',
+                    detected_conditions = %s,
+                    search_conditions = %s,
+                    partial_analysis = NULL,
+                    progress_section = NULL,
+                    progress_tokens = %s,
+                    updated_at = CURRENT_TIMESTAMP,
+                    error_message = NULL
+                WHERE id = %s AND claim_token = %s
+            """, (analysis_result, json.dumps(parse_sections(analysis_result)),
+                  json.dumps(detected), conditions_search_text(detected),
+                  on_token.state["tokens"] or None, job['id'], job['claim_token']))
+            # No row: the claim was requeued as stale and belongs to another worker now
+            if cursor.rowcount == 0:
+                return False
+            record_rollup(cursor, job['created_at'] and job['created_at'].date(), 'completed', job['specialty'],
+                          job['doctor_id'], detected, latency_ms)
+            return True
+
+        if run_in_transaction(complete):
+            print(f"[worker] Completed analysis {job['id']}")
+        else:
+            print(f"[worker] Lost claim on analysis {job['id']}, result discarded")
+
+    except Exception as proc_err:
+        err_text = f"{type(proc_err).__name__}: {proc_err}"
+        print(f"[worker] FAILED analysis {job['id']}: {err_text}")
+
+        def fail(cursor):
+            cursor.execute("""
+                UPDATE clinical_analyses
+                SET status = 'failed',
+                    partial_analysis = NULL,
+                    progress_section = NULL,
+                    progress_tokens = NULL,
+                    updated_at = CURRENT_TIMESTAMP,
+                    error_message = %s
+                WHERE id = %s AND claim_token = %s
+            """, (err_text, job['id'], job['claim_token']))
+            if cursor.rowcount > 0:
+                record_rollup(cursor, job['created_at'] and job['created_at'].date(), 'failed', job['specialty'],
+                              job['doctor_id'], detect_conditions(job['note']))
+
+        try:
+            run_in_transaction(fail)
+        except Exception as mark_err:
+            print("[worker] also failed to mark row as failed:", mark_err)
+
+
+def fill_search_conditions(batch_size: int = 500) -> int:
+    """
+    One-off: mirror detected_conditions into search_conditions for rows written before
+    the column existed, in short primary-key batches. One process at a time (named lock);
+    recorded in app_maintenance when a full pass finishes.
+    """
+    if maintenance_done("search_conditions"):
+        return 0
+    lock_conn = get_connection()
+    lock_cur = lock_conn.cursor()
+    lock_cur.execute("SELECT GET_LOCK('roundsiq_search_conditions', 0)")
+    if not lock_cur.fetchone()[0]:
+        lock_cur.close(); lock_conn.close()
+        return 0
+    try:
+        filled, last_id = 0, 0
+        while True:
+            conn = get_connection()
+            cur = conn.cursor(dictionary=True)
+            cur.execute("""
+                SELECT id, detected_conditions FROM clinical_analyses
+                WHERE id > %s AND search_conditions IS NULL AND detected_conditions IS NOT NULL
+                ORDER BY id LIMIT %s
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+            updates = []
+            for r in rows:
+                try:
+                    updates.append((conditions_search_text(json.loads(r["detected_conditions"])), r["id"]))
+                except (TypeError, ValueError):
+                    pass
+            if updates:
+                cur.executemany("UPDATE clinical_analyses SET search_conditions = %s WHERE id = %s", updates)
+                conn.commit()
+            cur.close(); conn.close()
+            if not rows:
+                break
+            filled += len(updates)
+            last_id = rows[-1]["id"]
+        mark_maintenance_done("search_conditions")
+        return filled
+    finally:
+        lock_cur.execute("SELECT RELEASE_LOCK('roundsiq_search_conditions')")
+        lock_cur.fetchone()
+        lock_cur.close(); lock_conn.close()
+
+def process_pending_jobs(stop_event: threading.Event | None = None):
+    """
+    Claim and run pending jobs until stop_event is set. The event is only checked
+    between claims, so claimed jobs always run to completion (graceful drain).
+    """
+    stop_event = stop_event or threading.Event()
     ensure_columns()
+    try:
+        filled = fill_search_conditions()
+        if filled:
+            print(f"[worker] filled search_conditions for {filled} row(s)")
+    except Exception as e:
+        print("[worker] search_conditions backfill failed (will retry on restart):", e)
     last_beat = 0
-    while True:
+    while not stop_event.is_set():
         try:
             if time.time() - last_beat > 15:
                 print("[worker] heartbeat OK")
                 last_beat = time.time()
+                requeued = requeue_stale_claims()
+                if requeued:
+                    print(f"[worker] requeued {requeued} stale claim(s)")
 
-            # --- claim one job atomically ---
+            # --- claim atomically ---
             conn = get_connection()
-            conn.start_transaction()  # explicit TX
-            cursor = conn.cursor(dictionary=True)
-
-            # Prefer SKIP LOCKED on MySQL 8.0+
             try:
-                cursor.execute("""
-                    SELECT id, patient_name, specialty, note, images_json
-                    FROM clinical_analyses
-                    WHERE status = 'pending'
-                    ORDER BY created_at ASC
-                    LIMIT 1
-                    FOR UPDATE SKIP LOCKED
-                """)
-            except mysql.connector.errors.ProgrammingError:
-                # Fallback for MySQL < 8.0 (no SKIP LOCKED)
-                cursor.execute("""
-                    SELECT id, patient_name, specialty, note, images_json
-                    FROM clinical_analyses
-                    WHERE status = 'pending'
-                    ORDER BY created_at ASC
-                    LIMIT 1
-                    FOR UPDATE
-                """)
-
-            job = cursor.fetchone()
-            if job:
-                cursor.execute("""
-                    UPDATE clinical_analyses
-                    SET status = 'processing', updated_at = CURRENT_TIMESTAMP, error_message = NULL
-                    WHERE id = %s AND status = 'pending'
-                """, (job['id'],))
-            conn.commit()
-            cursor.close(); conn.close()
+                jobs = claim_batch(conn, CLAIM_BATCH)
+            finally:
+                conn.close()
 
-            if not job:
-                time.sleep(2)
+            if not jobs:
+                stop_event.wait(2)
                 continue
 
-            print(f"[worker] Processing analysis {job['id']}...")
+            for job in jobs:
+                run_job(job)
 
-            # --- do the work ---
+        except Exception as loop_err:
+            print("[worker] loop error:", loop_err)
+            stop_event.wait(5)
+
+# ---------- Archiver ----------
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "0"))   # 0 disables the archiver
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "200"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+ARCHIVE_COLUMNS = ("id", "doctor_id", "patient_name", "specialty", "status", "note_z", "analysis_z",
+                   "images_z", "analysis_sections", "detected_conditions", "search_conditions",
+                   "search_text", "error_message", "created_at", "updated_at")
+
+def archive_search_text(note, analysis):
+    """Plain-text copy of an archived row's note and analysis for FULLTEXT search."""
+    return "\n\n".join(t for t in (note, analysis) if t) or None
+
+def maintenance_done(name: str) -> bool:
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM app_maintenance WHERE name = %s", (name,))
+    done = cur.fetchone() is not None
+    cur.close(); conn.close()
+    return done
+
+def mark_maintenance_done(name: str):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("INSERT IGNORE INTO app_maintenance (name) VALUES (%s)", (name,))
+    conn.commit()
+    cur.close(); conn.close()
+
+def storage_report() -> dict:
+    """Table sizes for the hot/archive tables plus the InnoDB buffer-pool hit rate."""
+    conn = get_connection()
+    cur = conn.cursor(dictionary=True)
+    cur.execute("""
+        SELECT TABLE_NAME AS table_name, TABLE_ROWS AS table_rows,
+               DATA_LENGTH AS data_bytes, INDEX_LENGTH AS index_bytes
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA = DATABASE()
+          AND TABLE_NAME IN ('clinical_analyses', 'clinical_analyses_archive')
+    """)
+    tables = {
+        r["table_name"]: {k: int(r[k] or 0) for k in ("table_rows", "data_bytes", "index_bytes")}
+        for r in cur.fetchall()
+    }
+    cur.execute("""
+        SHOW GLOBAL STATUS
+        WHERE Variable_name IN ('Innodb_buffer_pool_read_requests', 'Innodb_buffer_pool_reads')
+    """)
+    status = {r["Variable_name"]: int(r["Value"]) for r in cur.fetchall()}
+    cur.close(); conn.close()
+    read_requests = status.get("Innodb_buffer_pool_read_requests", 0)
+    disk_reads = status.get("Innodb_buffer_pool_reads", 0)
+    return {
+        "tables": tables,
+        "buffer_pool": {
+            "read_requests": read_requests,
+            "disk_reads": disk_reads,
+            "hit_rate": round(1 - disk_reads / read_requests, 6) if read_requests else None,
+        },
+    }
+
+def compact_legacy_images(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    One-off: move pre-compression images_json payloads into images_z, walking the primary key.
+    Rows whose images_json does not parse are left as they are. Recorded in app_maintenance
+    after a full pass, since new rows are always written to images_z.
+    """
+    if maintenance_done("compact_legacy_images"):
+        return 0
+    moved, skipped, last_id = 0, 0, 0
+    while True:
+        conn = get_connection()
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            SELECT id, images_json FROM clinical_analyses
+            WHERE id > %s AND images_json IS NOT NULL
+            ORDER BY id LIMIT %s
+        """, (last_id, batch_size))
+        rows = cur.fetchall()
+        updates = []
+        for r in rows:
             try:
-                images_data_uris = []
-                try:
-                    images_data_uris = json.loads(job.get("images_json") or "[]")
-                except Exception:
-                    pass
-                filenames_meta = [f"image_{i+1}.png (queued)" for i in range(len(images_data_uris))]
-
-                analysis_result, detected = run_gpt5_analysis(
-                    note=job['note'],
-                    specialty=job['specialty'],
-                    images_data_uris=images_data_uris,
-                    filenames_meta=filenames_meta
-                )
-
-                conn = get_connection()
-                cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE clinical_analyses
-                    SET analysis = %s,
-                        status = 'completed',
-                        detected_conditions = %s,
-                        updated_at = CURRENT_TIMESTAMP,
-                        error_message = NULL
-                    WHERE id = %s
-                """, (analysis_result, json.dumps(detected), job['id']))
-                conn.commit()
-                cursor.close(); conn.close()
-                print(f"[worker] Completed analysis {job['id']}")
+                updates.append((pack_images(json.loads(r["images_json"])), r["id"]))
+            except (TypeError, ValueError):
+                skipped += 1
+        if updates:
+            cur.executemany("UPDATE clinical_analyses SET images_z = %s, images_json = NULL WHERE id = %s", updates)
+            conn.commit()
+        cur.close(); conn.close()
+        if not rows:
+            break
+        moved += len(updates)
+        last_id = rows[-1]["id"]
+    if skipped:
+        print(f"[archiver] left {skipped} rows with unparseable images_json in place")
+    mark_maintenance_done("compact_legacy_images")
+    return moved
+
+def index_archived_text(batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """One-off: fill search_text for rows archived before the archive was searchable."""
+    if maintenance_done("archive_search_text"):
+        return 0
+    filled, last_id = 0, 0
+    while True:
+        conn = get_connection()
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            SELECT id, note_z, analysis_z FROM clinical_analyses_archive
+            WHERE id > %s AND search_text IS NULL
+            ORDER BY id LIMIT %s
+        """, (last_id, batch_size))
+        rows = cur.fetchall()
+        if rows:
+            cur.executemany(
+                "UPDATE clinical_analyses_archive SET search_text = %s WHERE id = %s",
+                [(archive_search_text(unpack_text(r["note_z"]), unpack_text(r["analysis_z"])), r["id"])
+                 for r in rows],
+            )
+            conn.commit()
+        cur.close(); conn.close()
+        if not rows:
+            break
+        filled += len(rows)
+        last_id = rows[-1]["id"]
+    mark_maintenance_done("archive_search_text")
+    return filled
+
+def archive_batch(days: int, batch_size: int) -> int:
+    """Move one batch of finished rows older than `days` into the compressed archive table."""
+    conn = get_connection()
+    conn.start_transaction()
+    cur = conn.cursor(dictionary=True)
+    try:
+        cur.execute("""
+            SELECT id, doctor_id, patient_name, specialty, status, note, analysis, images_json, images_z,
+                   analysis_sections, detected_conditions, search_conditions, error_message,
+                   created_at, updated_at
+            FROM clinical_analyses
+            WHERE status IN ('completed', 'failed')
+              AND created_at < NOW() - INTERVAL %s DAY
+            ORDER BY created_at
+            LIMIT %s
+            FOR UPDATE
+        """, (days, batch_size))
+        rows = cur.fetchall()
+        if rows:
+            # Never drop a hot row because its id is already archived (ids can be reused
+            # after a restart on MySQL < 8.0); leave it in place and report it instead
+            ids = [r["id"] for r in rows]
+            cur.execute(f"SELECT id FROM clinical_analyses_archive WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                        tuple(ids))
+            taken = {r["id"] for r in cur.fetchall()}
+            if taken:
+                print(f"[archiver] ids already in the archive, left in clinical_analyses: {sorted(taken)}")
+                rows = [r for r in rows if r["id"] not in taken]
+        if rows:
+            values = []
+            for r in rows:
+                r["note_z"] = pack_text(r["note"])
+                r["analysis_z"] = pack_text(r["analysis"])
+                r["search_text"] = archive_search_text(r["note"], r["analysis"])
+                # Legacy images_json is carried over verbatim rather than re-parsed
+                if r["images_z"] is None and r["images_json"] is not None:
+                    r["images_z"] = pack_text(r["images_json"])
+                values.append(tuple(r[c] for c in ARCHIVE_COLUMNS))
+            cur.executemany(f"""
+                INSERT INTO clinical_analyses_archive ({', '.join(ARCHIVE_COLUMNS)})
+                VALUES ({', '.join(['%s'] * len(ARCHIVE_COLUMNS))})
+            """, values)
+            ids = [r["id"] for r in rows]
+            cur.execute(f"DELETE FROM clinical_analyses WHERE id IN ({', '.join(['%s'] * len(ids))})", tuple(ids))
+        conn.commit()
+        return len(rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close(); conn.close()
 
-            except Exception as proc_err:
-                err_text = f"{type(proc_err).__name__}: {proc_err}"
-                print(f"[worker] FAILED analysis {job['id']}: {err_text}")
-                try:
-                    conn = get_connection()
-                    cursor = conn.cursor()
-                    cursor.execute("""
-                        UPDATE clinical_analyses
-                        SET status = 'failed',
-                            updated_at = CURRENT_TIMESTAMP,
-                            error_message = %s
-                        WHERE id = %s
-                    """, (err_text, job['id']))
-                    conn.commit()
-                    cursor.close(); conn.close()
-                except Exception as mark_err:
-                    print("[worker] also failed to mark row as failed:", mark_err)
+def archive_old_rows(days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """
+    One archiver pass: finish the one-off migrations (legacy image payloads, archive search
+    text), then move finished rows older than `days` to clinical_analyses_archive.
+    Guarded by a MySQL named lock so only one process runs it.
+    """
+    lock_conn = get_connection()
+    lock_cur = lock_conn.cursor()
+    lock_cur.execute("SELECT GET_LOCK('roundsiq_archiver', 0)")
+    if not lock_cur.fetchone()[0]:
+        lock_cur.close(); lock_conn.close()
+        return {"skipped": "another archiver is running"}
+    try:
+        before = storage_report()
+        compacted = compact_legacy_images(batch_size)
+        indexed = index_archived_text(batch_size)
+        archived = 0
+        while True:
+            n = archive_batch(days, batch_size)
+            archived += n
+            if n < batch_size:
+                break
+        after = storage_report()
+        print(f"[archiver] compacted={compacted} indexed={indexed} archived={archived} "
+              f"before={before['tables']} after={after['tables']}")
+        return {"compacted": compacted, "indexed": indexed, "archived": archived,
+                "before": before, "after": after}
+    finally:
+        lock_cur.execute("SELECT RELEASE_LOCK('roundsiq_archiver')")
+        lock_cur.fetchone()
+        lock_cur.close(); lock_conn.close()
 
-        except Exception as loop_err:
-            print("[worker] loop error:", loop_err)
-            time.sleep(5)
+def run_archiver():
+    ensure_columns()
+    while True:
+        try:
+            archive_old_rows()
+        except Exception as e:
+            print("[archiver] error:", e)
+        time.sleep(ARCHIVE_INTERVAL_SECONDS)
 
 @app.route('/health')
 def health():
     return jsonify({"ok": True})
 
-# Start worker thread
-threading.Thread(target=process_pending_jobs, daemon=True).start()
+@app.route('/limits')
+def limits():
+    """Configured admission limits and current usage (in-flight counts are per web process)."""
+    out = {"analyze": ANALYZE_LIMITER.snapshot()}
+    try:
+        usage = queue_usage(request.args.get("doctor_id"))
+        out["queue"] = {
+            "limit": MAX_PENDING or None,
+            "per_doctor_limit": MAX_PENDING_PER_DOCTOR or None,
+            "pending": usage["pending"],
+            "doctor_pending": usage["doctor_pending"],
+            "drain_rate_per_min": round(usage["drain_rate_per_s"] * 60, 2),
+        }
+    except Exception as e:
+        out["queue"] = {"error": str(e)}
+    return jsonify(out)
+
+@app.route('/storage_stats')
+def storage_stats():
+    try:
+        return jsonify(storage_report())
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# Embedded worker thread. Set EMBEDDED_WORKER=0 on web processes when jobs are
+# handled by the standalone worker (`python -m worker`).
+EMBEDDED_WORKER = os.getenv("EMBEDDED_WORKER", "1") == "1"
+
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "1"))
+
+def warm_up():
+    """
+    Runs in the background shortly after import so the server can bind and answer
+    /health first: builds the OpenAI client, then starts the embedded worker.
+    """
+    time.sleep(WARMUP_DELAY_SECONDS)
+    try:
+        get_client()
+    except Exception as e:
+        print("warm-up: OpenAI client init failed (will retry on first use):", e)
+    if EMBEDDED_WORKER:
+        threading.Thread(target=process_pending_jobs, daemon=True).start()
+        if ARCHIVE_AFTER_DAYS > 0:
+            threading.Thread(target=run_archiver, daemon=True).start()
+
+if os.getenv("WARMUP", "1") == "1":
+    threading.Thread(target=warm_up, daemon=True).start()
+elif EMBEDDED_WORKER:
+    threading.Thread(target=process_pending_jobs, daemon=True).start()
 
 # ---------- History / Compare ----------
+HISTORY_DEFAULT_LIMIT = 50
+HISTORY_MAX_LIMIT = 200
+
+def encode_cursor(created_at, row_id) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    ts, row_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(ts), int(row_id)
+
 @app.route('/history', methods=['GET'])
 def history():
+    """
+    Keyset-paginated history for one patient, newest first.
+    Query params: patient_name (required), limit, before (cursor from a
+    previous page's next_cursor), and optional status / specialty / doctor_id.
+    """
     patient_name = request.args.get("patient_name", "").strip()
     if not patient_name:
         return jsonify({"error": "Missing patient_name"}), 400
+
     try:
+        limit = int(request.args.get("limit", HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+
+    where = ["patient_name = %s"]
+    params = [patient_name]
+
+    before = request.args.get("before")
+    if before:
+        try:
+            before_ts, before_id = decode_cursor(before)
+        except Exception:
+            return jsonify({"error": "Invalid cursor"}), 400
+        # Row-value comparison written out so MySQL can range-scan idx_patient_created
+        where.append("(created_at < %s OR (created_at = %s AND id < %s))")
+        params += [before_ts, before_ts, before_id]
+
+    for col in ("status", "specialty", "doctor_id"):
+        val = request.args.get(col)
+        if val:
+            where.append(f"{col} = %s")
+            params.append(val)
+
+    try:
+        ensure_columns()
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT id, patient_name, specialty, created_at, status
-            FROM clinical_analyses
-            WHERE patient_name = %s
-            ORDER BY created_at DESC
-        """, (patient_name,))
+        # Fetch one extra row to know whether another page exists. Each half of the
+        # UNION walks its own (patient_name, created_at) index; archived rows follow hot ones.
+        page_sql = f"""
+            SELECT id, patient_name, specialty, doctor_id, created_at, status
+            FROM {{table}}
+            WHERE {' AND '.join(where)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """
+        cursor.execute(f"""
+            ({page_sql.format(table='clinical_analyses')})
+            UNION ALL
+            ({page_sql.format(table='clinical_analyses_archive')})
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        """, (*params, limit + 1, *params, limit + 1, limit + 1))
         rows = cursor.fetchall()
         cursor.close(); conn.close()
-        return jsonify([
-            {
-                "id": r["id"],
-                "patient_name": r["patient_name"],
-                "specialty": r["specialty"],
-                "status": r.get("status", "completed"),
-                "created_at": r["created_at"].isoformat() if r["created_at"] else None
-            } for r in rows
-        ])
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more and rows[-1]["created_at"]:
+            next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+        return jsonify({
+            "items": [
+                {
+                    "id": r["id"],
+                    "patient_name": r["patient_name"],
+                    "specialty": r["specialty"],
+                    "doctor_id": r.get("doctor_id"),
+                    "status": r.get("status", "completed"),
+                    "created_at": r["created_at"].isoformat() if r["created_at"] else None
+                } for r in rows
+            ],
+            "next_cursor": next_cursor,
+        })
     except Exception as e:
         return jsonify({"error": f"DB error: {str(e)}"}), 500
 
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    Ranked full-text search over note, analysis and detected conditions, hot and archived rows.
+    Query params: q (required), mode=natural|boolean, limit, offset, archived=0 to skip the
+    archive, and optional patient_name / status / specialty / doctor_id / from / to (created_at dates).
+    Each table has its own FULLTEXT index, so scores across the two are only roughly comparable.
+    """
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"error": "Missing q"}), 400
+    mode = "IN BOOLEAN MODE" if request.args.get("mode") == "boolean" else "IN NATURAL LANGUAGE MODE"
+    include_archived = request.args.get("archived", "1") != "0"
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT))
+        offset = max(0, int(request.args.get("offset", 0)))
+    except ValueError:
+        return jsonify({"error": "Invalid limit or offset"}), 400
+    # Deep OFFSETs re-rank everything they skip; ask callers to refine the query instead
+    if offset > SEARCH_MAX_OFFSET:
+        return jsonify({"error": f"offset may not exceed {SEARCH_MAX_OFFSET}; narrow the query"}), 400
+
+    filters = []
+    params = []
+    for col in ("patient_name", "status", "specialty", "doctor_id"):
+        val = request.args.get(col)
+        if val:
+            filters.append(f"{col} = %s")
+            params.append(val)
+    if request.args.get("from"):
+        filters.append("created_at >= %s")
+        params.append(request.args["from"])
+    if request.args.get("to"):
+        filters.append("created_at < %s")
+        params.append(request.args["to"])
+
+    def branch(table, text_cols, snippet_col, archived):
+        match_sql = f"MATCH({text_cols}) AGAINST (%s {mode})"
+        return f"""
+            SELECT id, patient_name, specialty, doctor_id, status, detected_conditions, created_at,
+                   LEFT({snippet_col}, 200) AS snippet, {match_sql} AS score, {archived} AS archived
+            FROM {table}
+            WHERE {' AND '.join([match_sql, *filters])}
+            ORDER BY score DESC, id DESC
+            LIMIT %s
+        """
+
+    # Each branch only needs enough rows to fill this page; the outer query re-ranks them
+    branch_params = (q, q, *params, offset + limit + 1)
+    sql = f"({branch('clinical_analyses', 'note, analysis, search_conditions', 'note', 0)})"
+    sql_params = branch_params
+    if include_archived:
+        sql += f"""
+            UNION ALL
+            ({branch('clinical_analyses_archive', 'search_text, search_conditions', 'search_text', 1)})"""
+        sql_params += branch_params
+
+    try:
+        ensure_columns()
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute(f"""
+            {sql}
+            ORDER BY score DESC, id DESC
+            LIMIT %s OFFSET %s
+        """, (*sql_params, limit + 1, offset))
+        rows = cursor.fetchall()
+        cursor.close(); conn.close()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        for r in rows:
+            try:
+                r["detected_conditions"] = json.loads(r["detected_conditions"]) if r["detected_conditions"] else []
+            except Exception:
+                r["detected_conditions"] = []
+            r["score"] = float(r["score"] or 0)
+            r["archived"] = bool(r["archived"])
+            r["created_at"] = r["created_at"].isoformat() if r["created_at"] else None
+
+        return jsonify({
+            "items": rows,
+            "next_offset": offset + limit if has_more else None,
+        })
+    except Exception as e:
+        return jsonify({"error": f"Search error: {str(e)}"}), 500
+
+QUEUE_WAIT_WINDOW_MINUTES = int(os.getenv("QUEUE_WAIT_WINDOW_MINUTES", "60"))
+
+def percentile(values: list, pct: float) -> float:
+    """Nearest-rank percentile; 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_DAYS = 366
+
+@app.route('/analytics')
+def analytics():
+    """
+    Dashboard data from the daily rollups: per-day counts by status, totals by
+    specialty / doctor / detected condition, and model latency percentiles.
+    Query params: from, to (YYYY-MM-DD, inclusive) or days (default 30).
+    """
+    try:
+        end = date.fromisoformat(request.args["to"]) if request.args.get("to") else date.today()
+        if request.args.get("from"):
+            start = date.fromisoformat(request.args["from"])
+        else:
+            start = end - timedelta(days=int(request.args.get("days", ANALYTICS_DEFAULT_DAYS)) - 1)
+    except ValueError:
+        return jsonify({"error": "Invalid from/to/days"}), 400
+    if start > end or (end - start).days >= ANALYTICS_MAX_DAYS:
+        return jsonify({"error": f"Range must be 1-{ANALYTICS_MAX_DAYS} days"}), 400
+
+    try:
+        ensure_columns()
+        conn = get_connection()
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            SELECT day, dimension, dim_value, status, n FROM analytics_daily
+            WHERE day BETWEEN %s AND %s
+        """, (start, end))
+        rows = cur.fetchall()
+        cur.execute("""
+            SELECT bucket, SUM(n) AS n FROM analytics_latency_daily
+            WHERE day BETWEEN %s AND %s GROUP BY bucket
+        """, (start, end))
+        buckets = {r["bucket"]: int(r["n"]) for r in cur.fetchall()}
+        cur.close(); conn.close()
+
+        per_day, totals = {}, {}
+        breakdowns = {"specialty": {}, "doctor": {}, "condition": {}}
+        for r in rows:
+            if r["dimension"] == "all":
+                per_day.setdefault(r["day"].isoformat(), {})[r["status"]] = r["n"]
+                totals[r["status"]] = totals.get(r["status"], 0) + r["n"]
+            elif r["dimension"] in breakdowns:
+                by_status = breakdowns[r["dimension"]].setdefault(r["dim_value"], {})
+                by_status[r["status"]] = by_status.get(r["status"], 0) + r["n"]
+
+        return jsonify({
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "per_day": [{"day": d, **per_day[d]} for d in sorted(per_day)],
+            "totals": totals,
+            "by_specialty": breakdowns["specialty"],
+            "by_doctor": breakdowns["doctor"],
+            "by_condition": breakdowns["condition"],
+            "latency_ms": latency_percentiles(buckets),
+        })
+    except Exception as e:
+        return jsonify({"error": f"Analytics error: {str(e)}"}), 500
+
 @app.route('/worker_stats')
 def worker_stats():
     try:
@@ -636,11 +1923,62 @@ def worker_stats():
         processing = cur.fetchone()['c']
         cur.execute("SELECT COUNT(*) AS c FROM clinical_analyses WHERE status='failed'")
         failed = cur.fetchone()['c']
+        cur.execute("""
+            SELECT priority, COUNT(*) AS c FROM clinical_analyses
+            WHERE status='pending' GROUP BY priority
+        """)
+        pending_by_priority = {PRIORITY_NAMES.get(r['priority'], str(r['priority'])): r['c'] for r in cur.fetchall()}
+        # Queue wait (created -> claimed) for jobs claimed in the stats window
+        cur.execute("""
+            SELECT priority, TIMESTAMPDIFF(MICROSECOND, created_at, claimed_at) / 1e6 AS wait_s
+            FROM clinical_analyses
+            WHERE claimed_at >= NOW() - INTERVAL %s MINUTE
+        """, (QUEUE_WAIT_WINDOW_MINUTES,))
+        waits = {}
+        for r in cur.fetchall():
+            waits.setdefault(PRIORITY_NAMES.get(r['priority'], str(r['priority'])), []).append(float(r['wait_s'] or 0))
         cur.close(); conn.close()
-        return jsonify({"pending": pending, "processing": processing, "failed": failed})
+        return jsonify({
+            "pending": pending,
+            "processing": processing,
+            "failed": failed,
+            "pending_by_priority": pending_by_priority,
+            "queue_wait_window_minutes": QUEUE_WAIT_WINDOW_MINUTES,
+            "queue_wait_p95_s": {name: round(percentile(w, 95), 3) for name, w in waits.items()},
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# ---------- Section diff cache ----------
+COMPARE_CACHE_SIZE = int(os.getenv("COMPARE_CACHE_SIZE", "256"))
+_compare_cache = OrderedDict()   # (id1, id2, section keys) -> (stamp, {section_key: [diff lines]})
+_compare_lock = threading.Lock()
+
+def section_diff(sections1: dict, sections2: dict, keys: list) -> dict:
+    diff = {}
+    for key in keys:
+        a = (sections1.get(key) or "").splitlines()
+        b = (sections2.get(key) or "").splitlines()
+        diff[key] = list(difflib.unified_diff(a, b, "id1", "id2", lineterm="", n=1))
+    return diff
+
+def cached_section_diff(record1: dict, record2: dict, sections1: dict, sections2: dict, keys: list) -> dict:
+    """Diff of `keys` for the (id1, id2) pair; recomputed if either row changed since."""
+    key = (record1["id"], record2["id"], tuple(keys))
+    stamp = (record1.get("updated_at"), record2.get("updated_at"))
+    with _compare_lock:
+        hit = _compare_cache.get(key)
+        if hit and hit[0] == stamp:
+            _compare_cache.move_to_end(key)
+            return hit[1]
+    diff = section_diff(sections1, sections2, keys)
+    with _compare_lock:
+        _compare_cache[key] = (stamp, diff)
+        _compare_cache.move_to_end(key)
+        while len(_compare_cache) > COMPARE_CACHE_SIZE:
+            _compare_cache.popitem(last=False)
+    return diff
+
 @app.route('/compare', methods=['GET'])
 def compare():
     id1 = request.args.get("id1")
@@ -648,29 +1986,66 @@ def compare():
     render = request.args.get("render", "html")
     if not id1 or not id2:
         return jsonify({"error": "Missing id1 or id2"}), 400
+    requested = resolve_section_keys(request.args.get("sections"))
+    if request.args.get("sections") and not requested:
+        return jsonify({"error": "Unknown section(s)", "available": SECTION_KEYS}), 400
+    try:
+        id1, id2 = int(id1), int(id2)
+    except ValueError:
+        return jsonify({"error": "id1 and id2 must be integers"}), 400
+    # The HTML view and the default JSON payload still show whole analyses
+    want_full = render != "json" or not requested
+    keys = requested if render == "json" and requested else SECTION_KEYS
     try:
+        ensure_columns()
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
-        cursor.execute("""SELECT id, patient_name, specialty, note, analysis, created_at
-                          FROM clinical_analyses WHERE id = %s""", (id1,))
-        record1 = cursor.fetchone()
-        cursor.execute("""SELECT id, patient_name, specialty, note, analysis, created_at
-                          FROM clinical_analyses WHERE id = %s""", (id2,))
-        record2 = cursor.fetchone()
+        cursor.execute(f"""
+            SELECT id, patient_name, specialty, {'note, analysis AS full_analysis,' if want_full else ''}
+                   created_at, updated_at, {section_select_sql(keys)}
+            FROM clinical_analyses WHERE id IN (%s, %s)
+        """, (id1, id2))
+        rows = {r["id"]: r for r in cursor.fetchall()}
         cursor.close(); conn.close()
+        missing = [i for i in {id1, id2} if i not in rows]
+        for row_id, r in fetch_archived_records(missing).items():
+            # Shape archived rows like the hot-table query above
+            sections = load_sections(r)
+            rows[row_id] = {
+                "id": row_id, "patient_name": r["patient_name"], "specialty": r["specialty"],
+                "created_at": r["created_at"], "updated_at": r["updated_at"], "analysis": None,
+                **({"note": r["note"], "full_analysis": r["analysis"]} if want_full else {}),
+                **{f"sec_{key}": sections.get(key) for key in keys},
+            }
+        record1, record2 = rows.get(id1), rows.get(id2)
         if not record1 or not record2:
             return jsonify({"error": "One or both records not found"}), 404
+
+        if id1 == id2:
+            record2 = dict(record1)
+        sections1 = collect_sections(record1, keys)
+        sections2 = collect_sections(record2, keys)
+        for record in (record1, record2):
+            if want_full:
+                record["analysis"] = record.pop("full_analysis")
+
         if render == "json":
-            return jsonify({"comparison": [record1, record2]})
+            diff = cached_section_diff(record1, record2, sections1, sections2, keys)
+            if requested:
+                record1["sections"] = {k: sections1.get(k) for k in keys}
+                record2["sections"] = {k: sections2.get(k) for k in keys}
+            return jsonify({
+                "comparison": [record1, record2],
+                "diff": diff,
+            })
         else:
             return render_template_string(HTML_TEMPLATE, record1=record1, record2=record2)
     except Exception as e:
         return jsonify({"error": f"DB compare error: {str(e)}"}), 500
     
 if __name__ == '__main__':
-    # Start worker once
-    threading.Thread(target=process_pending_jobs, daemon=True).start()
-    app.run(host='0.0.0.0', port=5000, debug=False, use_reloader=False, threaded=True)
+    # The embedded worker (if enabled) is started by the warm-up thread
+    app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=False, use_reloader=False, threaded=True)
     
 
 #if __name__ == '__main__':
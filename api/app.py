@@ -1,14 +1,13 @@
 from __future__ import annotations
 from flask import Flask, request, jsonify, render_template_string, Response, stream_with_context
 from dotenv import load_dotenv
-import os, io, base64, json, traceback, threading, time
+import os, io, base64, traceback, threading, time
 import mysql.connector
 from mysql.connector import Error
 from pathlib import Path
-from openai import OpenAI
-import httpx
+from http_encoding import install_json, install_compression, dumps
+from admission import STREAM_LIMITER, too_busy
 from flask_cors import CORS
-from openai import BadRequestError  
 
 # ---------- Load environment variables ----------
 load_dotenv(dotenv_path=Path(__file__).parent / ".env")
@@ -21,21 +20,41 @@ FULL_MODEL = os.getenv("FULL_MODEL", "gpt-5")
 FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4o-mini")  # keep FAST truly fast
 
 # ---------- OpenAI clients: FAST (short) and FULL (long) ----------
-proxy = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY")
-
-fast_timeout = httpx.Timeout(10.0, read=20.0, write=10.0, connect=10.0)
-full_timeout = httpx.Timeout(30.0, read=180.0, write=30.0, connect=15.0)
-
-# Use HTTP/2 for lower handshake latency + persistent connections
-if proxy:
-    fast_http = httpx.Client(proxies=proxy, timeout=fast_timeout, http2=True)
-    full_http = httpx.Client(proxies=proxy, timeout=full_timeout, http2=True)
-else:
-    fast_http = httpx.Client(timeout=fast_timeout, http2=True)
-    full_http = httpx.Client(timeout=full_timeout, http2=True)
-
-fast_client = OpenAI(api_key=OPENAI_API_KEY, http_client=fast_http)
-full_client = OpenAI(api_key=OPENAI_API_KEY, http_client=full_http)
+# Built on first use (or by the background warm-up) so importing the app stays cheap.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _build_client(kind: str):
+    import httpx
+    from openai import OpenAI
+
+    proxy = os.getenv("HTTPS_PROXY") or os.getenv("HTTP_PROXY")
+    if kind == "fast":
+        timeout = httpx.Timeout(10.0, read=20.0, write=10.0, connect=10.0)
+    else:
+        timeout = httpx.Timeout(30.0, read=180.0, write=30.0, connect=15.0)
+
+    # Use HTTP/2 for lower handshake latency + persistent connections
+    if proxy:
+        http = httpx.Client(proxies=proxy, timeout=timeout, http2=True)
+    else:
+        http = httpx.Client(timeout=timeout, http2=True)
+    return OpenAI(api_key=OPENAI_API_KEY, http_client=http)
+
+def get_openai_client(kind: str):
+    client = _clients.get(kind)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(kind)
+            if client is None:
+                client = _clients[kind] = _build_client(kind)
+    return client
+
+def get_fast_client():
+    return get_openai_client("fast")
+
+def get_full_client():
+    return get_openai_client("full")
 
 # Database settings
 DB_HOST = os.getenv("DB_HOST")
@@ -50,6 +69,10 @@ app.secret_key = os.getenv("SECRET_KEY", "default_secret_key")
 # CORS
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=False)
 
+# Fast JSON (ISO datetimes) + gzip/brotli negotiation; SSE stays uncompressed by default
+install_json(app)
+install_compression(app)
+
 # ---------- DB helpers ----------
 def get_connection():
     return mysql.connector.connect(
@@ -120,6 +143,7 @@ def ensure_columns():
 # ---------- Stream the response using SSE ----------
 @app.route('/analyze_stream', methods=['POST', 'GET', 'OPTIONS'])
 def analyze_stream():
+    slot = None
     try:
         if request.method == 'OPTIONS':
             return ('', 204)
@@ -127,14 +151,21 @@ def analyze_stream():
         if request.method == 'GET':
             note = (request.args.get("note") or "").strip()
             specialty = request.args.get("specialty", "general")
+            doctor_id = request.args.get("doctor_id")
         else:
             data = request.get_json(silent=True) or {}
             note = (data.get("note") or "").strip()
             specialty = data.get("specialty", "general")
+            doctor_id = data.get("doctor_id")
 
         if not note:
             return jsonify({"error": "Missing clinical note"}), 400
 
+        # Refuse fast rather than tying up another thread on a long model stream
+        slot = STREAM_LIMITER.acquire(doctor_id)
+        if not slot.ok:
+            return too_busy(slot.scope, slot.retry_after, "concurrent streams")
+
         patient_name = note.split(",")[0].strip() if "," in note else "Unknown"
         detected = detect_conditions(note)
 
@@ -146,6 +177,8 @@ def analyze_stream():
         ]
 
         def generate():
+            from openai import BadRequestError
+            full_client = get_full_client()
             full_text_parts = []
             emitted_any = False
 
@@ -173,13 +206,13 @@ def analyze_stream():
                     if token:
                         full_text_parts.append(token)
                         emitted_any = True
-                        yield f"event: token\ndata:{json.dumps(token)}\n\n"
+                        yield f"event: token\ndata:{dumps(token)}\n\n"
 
             except BadRequestError as e:
                 # Handle errors in case streaming fails
-                yield f"event: warn\ndata:{json.dumps('Streaming not available; falling back to full response.')}\n\n"
+                yield f"event: warn\ndata:{dumps('Streaming not available; falling back to full response.')}\n\n"
             except Exception as e:
-                yield f"event: warn\ndata:{json.dumps('Streaming error: ' + str(e))}\n\n"
+                yield f"event: warn\ndata:{dumps('Streaming error: ' + str(e))}\n\n"
 
             # 2) Fallback if no tokens were emitted
             if not emitted_any:
@@ -200,7 +233,7 @@ def analyze_stream():
                         text = (choice.message.content or "").strip()
 
                         # Surface what happened
-                        yield f"event: debug\ndata:{json.dumps({'model': m, 'finish_reason': last_reason})}\n\n"
+                        yield f"event: debug\ndata:{dumps({'model': m, 'finish_reason': last_reason})}\n\n"
 
                         if text:
                             analysis = text
@@ -211,16 +244,16 @@ def analyze_stream():
                             continue
 
                     except Exception as e2:
-                        yield f"event: warn\ndata:{json.dumps(f'Fallback call failed on {m}: {str(e2)[:160]}')}\n\n"
+                        yield f"event: warn\ndata:{dumps(f'Fallback call failed on {m}: {str(e2)[:160]}')}\n\n"
                         continue
 
                 if analysis:
-                    yield f"event: token\ndata:{json.dumps(analysis)}\n\n"
+                    yield f"event: token\ndata:{dumps(analysis)}\n\n"
                 else:
                     msg = "All fallbacks returned empty text"
                     if last_reason:
                         msg += f" (finish_reason={last_reason})"
-                    yield f"event: error\ndata:{json.dumps(msg)}\n\n"
+                    yield f"event: error\ndata:{dumps(msg)}\n\n"
 
             # 3) Save final result to DB
             analysis = "".join(full_text_parts).strip()
@@ -234,12 +267,12 @@ def analyze_stream():
                 """, (patient_name, specialty, note, analysis))
                 conn.commit()
             except Exception as db_err:
-                yield f"event: warn\ndata:{json.dumps(f'DB save warning: {db_err}')}\n\n"
+                yield f"event: warn\ndata:{dumps(f'DB save warning: {db_err}')}\n\n"
             finally:
                 try: cursor.close(); conn.close()
                 except Exception: pass
 
-            yield f"event: done\ndata:{json.dumps({'status':'done','detected_conditions': detected})}\n\n"
+            yield f"event: done\ndata:{dumps({'status':'done','detected_conditions': detected})}\n\n"
 
         headers = {
             "Content-Type": "text/event-stream",
@@ -250,12 +283,37 @@ def analyze_stream():
             "Access-Control-Allow-Methods": "GET,POST,OPTIONS",
             "Access-Control-Allow-Headers": "Content-Type",
         }
-        return Response(stream_with_context(generate()), headers=headers)
+        resp = Response(stream_with_context(generate()), headers=headers)
+        # The WSGI server closes the response on completion and on client disconnect,
+        # even if the generator was never started
+        resp.call_on_close(slot.release)
+        return resp
 
     except Exception as e:
         traceback.print_exc()
+        if slot is not None:
+            slot.release()
         return jsonify({"error": str(e)}), 500
 
+WARMUP_DELAY_SECONDS = float(os.getenv("WARMUP_DELAY_SECONDS", "1"))
+
+def warm_up():
+    """Build both clients in the background once the server is up, off the request path."""
+    time.sleep(WARMUP_DELAY_SECONDS)
+    for kind in ("fast", "full"):
+        try:
+            get_openai_client(kind)
+        except Exception as e:
+            print(f"warm-up: {kind} client init failed (will retry on first use):", e)
+
+if os.getenv("WARMUP", "1") == "1":
+    threading.Thread(target=warm_up, daemon=True).start()
+
+@app.route('/limits')
+def limits():
+    """Stream admission limits and current usage for this web process."""
+    return jsonify({"analyze_stream": STREAM_LIMITER.snapshot()})
+
 # Run the Flask app
 if __name__ == '__main__':
     threading.Thread(target=process_pending_jobs, daemon=True).start()
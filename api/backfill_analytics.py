@@ -0,0 +1,37 @@
+"""
+Rebuild the analytics rollup tables from clinical_analyses (and its archive).
+
+    python backfill_analytics.py                 # everything
+    python backfill_analytics.py --since 2025-01-01
+
+Safe to re-run: the affected days are deleted and recomputed in one transaction.
+Jobs that finish while it runs may be counted twice or not at all for today,
+so run it off-peak, or re-run it for that day afterwards.
+"""
+from __future__ import annotations
+import argparse, os, sys, time
+from datetime import date
+
+os.environ["EMBEDDED_WORKER"] = "0"
+os.environ["WARMUP"] = "0"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild analytics_daily / analytics_latency_daily.")
+    parser.add_argument("--since", type=date.fromisoformat, default=None,
+                        help="only rebuild days from this date (YYYY-MM-DD)")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    from worker import load_app
+    app = load_app()
+    app.ensure_columns()
+    t0 = time.perf_counter()
+    result = app.backfill_rollups(since=args.since, batch_size=args.batch_size)
+    print(f"backfill done in {time.perf_counter() - t0:.1f}s: "
+          f"{result['rollup_rows']} rollup rows, {result['latency_buckets']} latency buckets")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
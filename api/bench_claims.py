@@ -0,0 +1,120 @@
+"""
+Job-claim contention benchmark: 1-16 concurrent claimers per strategy.
+
+    python bench_claims.py --database roundsiq_bench --jobs 2000
+
+Uses the DB_HOST/DB_USER/DB_PASS settings from .env but a separate scratch
+database (it must already exist and must not be DB_NAME), because the
+benchmark truncates clinical_analyses there. Every claimer loops
+claim_jobs() until the queue is empty; no model calls are made.
+"""
+from __future__ import annotations
+import argparse, os, statistics, threading, time
+
+# Configure the app before loading it: no poller, no warm-up, scratch database
+os.environ["EMBEDDED_WORKER"] = "0"
+os.environ["WARMUP"] = "0"
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+BASE_TABLE_DDL = """
+    CREATE TABLE IF NOT EXISTS clinical_analyses (
+        id INT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        patient_name VARCHAR(255) NULL,
+        specialty VARCHAR(100) NULL,
+        note TEXT NULL,
+        analysis MEDIUMTEXT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB
+"""
+
+
+def seed(app, n_jobs: int, n_doctors: int):
+    conn = app.get_connection()
+    cur = conn.cursor()
+    cur.execute("TRUNCATE TABLE clinical_analyses")
+    cur.execute("TRUNCATE TABLE queue_doctor_service")
+    rows = [(i % n_doctors + 1, f"bench-{i}", "general", "bench note", 2 if i % 50 == 0 else 0)
+            for i in range(n_jobs)]
+    cur.executemany("""
+        INSERT INTO clinical_analyses (doctor_id, patient_name, specialty, note, priority, status, created_at)
+        VALUES (%s, %s, %s, %s, %s, 'pending', CURRENT_TIMESTAMP)
+    """, rows)
+    conn.commit()
+    cur.close(); conn.close()
+
+
+def run(app, strategy: str, workers: int, batch: int) -> dict:
+    claim_times, claimed, errors = [], [0], [0]
+    lock = threading.Lock()
+
+    def claimer():
+        conn = app.get_connection()
+        while True:
+            t0 = time.perf_counter()
+            try:
+                jobs = app.claim_batch(conn, batch, strategy=strategy)
+            except Exception:
+                with lock:
+                    errors[0] += 1
+                    if errors[0] > 100:   # e.g. skip_locked on a server without it
+                        break
+                continue
+            elapsed = time.perf_counter() - t0
+            if not jobs:
+                break
+            with lock:
+                claim_times.append(elapsed)
+                claimed[0] += len(jobs)
+        conn.close()
+
+    threads = [threading.Thread(target=claimer) for _ in range(workers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    claim_times.sort()
+    return {
+        "claimed": claimed[0],
+        "errors": errors[0],
+        "throughput": claimed[0] / wall if wall else 0.0,
+        "p50_ms": statistics.median(claim_times) * 1000 if claim_times else 0.0,
+        "p95_ms": claim_times[int(len(claim_times) * 0.95) - 1] * 1000 if claim_times else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark job-claim contention across strategies.")
+    parser.add_argument("--database", required=True, help="scratch database (will be truncated)")
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--doctors", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--workers", default="1,2,4,8,16")
+    parser.add_argument("--strategies", default="skip_locked,update")
+    args = parser.parse_args(argv)
+
+    from worker import load_app
+    app = load_app()
+    if args.database == app.DB_NAME:
+        parser.error("--database must be a scratch database, not DB_NAME")
+    app.DB_NAME = args.database
+
+    conn = app.get_connection()
+    cur = conn.cursor()
+    cur.execute(BASE_TABLE_DDL)
+    conn.commit()
+    cur.close(); conn.close()
+    app.ensure_columns()
+
+    print(f"{'strategy':>12} {'workers':>7} {'claimed':>8} {'errors':>6} {'jobs/s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for strategy in args.strategies.split(","):
+        for workers in (int(w) for w in args.workers.split(",")):
+            seed(app, args.jobs, args.doctors)
+            r = run(app, strategy, workers, args.batch)
+            print(f"{strategy:>12} {workers:>7} {r['claimed']:>8} {r['errors']:>6} "
+                  f"{r['throughput']:>9.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Wire-size and serialization benchmark for large API payloads.
+
+    python bench_payloads.py --images 2 --runs 50
+
+Builds a /get_analysis-shaped record (multi-KB analysis, base64 PNG data URIs,
+datetimes) and reports encode time for the stock Flask-style encoder vs
+http_encoding.dumps, and bytes on the wire for identity / gzip / brotli.
+"""
+from __future__ import annotations
+import argparse, base64, json, os, statistics, time
+from datetime import datetime
+
+import http_encoding
+
+
+# A representative model answer: ten sections of distinct clinical prose, no repeated filler,
+# so compression ratios reflect real text. Pass --analysis-file to use an exported analysis.
+SAMPLE_ANALYSIS = """1. Differential Diagnosis
+- Sepsis from a urinary source is most likely: fever 38.9 C, HR 118, MAP 61, lactate 4.1 mmol/L, pyuria with nitrites, and CVA tenderness on the right.
+- Obstructive pyelonephritis must be excluded given the history of nephrolithiasis; an infected obstructed kidney needs urgent decompression.
+- Intra-abdominal source (cholangitis, diverticular abscess) is less likely with a benign abdomen and normal bilirubin, but keep it open if cultures are unrevealing.
+- Community-acquired pneumonia is unlikely: SpO2 96% on room air, clear lungs, no infiltrate on the portable film.
+- Non-infectious mimics to consider: adrenal crisis (on chronic prednisone 10 mg), drug reaction, and early pancreatitis.
+
+2. Pathophysiology Integration
+Gram-negative bacteremia drives cytokine-mediated vasodilation and capillary leak, producing the distributive picture. Elevated lactate reflects both tissue hypoperfusion and beta-2 driven aerobic glycolysis. Chronic glucocorticoid use blunts the fever curve and the stress response, so her hemodynamic reserve is lower than the vitals suggest. The creatinine of 2.3 from a baseline of 0.9 is most consistent with prerenal injury with a possible obstructive component.
+
+3. Diagnostic Workup
+- Two sets of blood cultures and a urine culture before antibiotics, without delaying the first dose beyond 60 minutes.
+- Repeat lactate within 2-4 hours to confirm clearance.
+- CT abdomen/pelvis without contrast to evaluate for an obstructing stone and perinephric collection.
+- CBC with differential, CMP, coagulation panel, procalcitonin as a baseline for de-escalation.
+- Morning cortisol is not interpretable on prednisone; treat empirically rather than test.
+
+4. Treatment and Medications
+- Crystalloid 30 mL/kg (about 2.1 L) over the first 3 hours, reassessing volume status after each liter.
+- Ceftriaxone 2 g IV q24h; escalate to cefepime 2 g IV q8h if she was hospitalized in the last 90 days or has prior resistant isolates.
+- Norepinephrine if MAP stays below 65 after fluids, targeting MAP 65-70.
+- Stress-dose hydrocortisone 50 mg IV q6h given chronic steroid exposure and vasopressor need.
+- Hold lisinopril and metformin; renally dose all medications while the creatinine is elevated.
+
+5. Risk Stratification & Clinical Judgment
+qSOFA is 2 (hypotension, tachypnea) and SOFA rises by at least 3 from baseline, placing her at roughly 10-20% in-hospital mortality. Immunosuppression and possible obstruction are the two features most likely to turn this into refractory shock, so source control timing matters more than antibiotic breadth.
+
+6. Management of Chronic Conditions
+- Type 2 diabetes: insulin sliding scale with a target glucose of 140-180 mg/dL; resume metformin only once renal function recovers.
+- Rheumatoid arthritis: continue steroids at stress dose and hold methotrexate during active infection.
+- Hypertension: antihypertensives held while hypotensive; reintroduce amlodipine first once stable.
+
+7. Infection Consideration & Antibiotics
+Review prior urine cultures: a 2023 isolate of E. coli resistant to fluoroquinolones argues against ciprofloxacin as oral step-down. Narrow to the susceptibility-guided agent at 48-72 hours. Total duration 7 days if source control is achieved and bacteremia clears promptly, 14 days if a perinephric abscess is found.
+
+8. Disposition & Follow-Up
+Admit to step-down with a low threshold for ICU transfer if norepinephrine exceeds 0.1 mcg/kg/min. Urology consult today if CT shows obstruction. Follow-up with nephrology in 2 weeks to confirm renal recovery, and with rheumatology before methotrexate is restarted.
+
+9. Red Flags or Missed Diagnoses
+- Rising lactate despite fluids, new oxygen requirement, or altered mentation should prompt ICU evaluation.
+- Emphysematous pyelonephritis in a diabetic patient: look for gas on CT.
+- Persistent bacteremia beyond 72 hours warrants echocardiography and a search for a deep focus.
+
+10. Clinical Guidelines Integration
+Aligns with CMS SEP-1 bundle timing (lactate, cultures, antibiotics within 3 hours; fluids for hypotension or lactate of 4 or more; vasopressors and reassessment within 6 hours) and Surviving Sepsis Campaign 2021 recommendations. Steroid dosing follows guidance for patients with chronic glucocorticoid exposure. Antibiotic duration is consistent with IDSA guidance for complicated urinary tract infection.
+"""
+
+
+def sample_record(n_images: int, image_kb: int, analysis: str = SAMPLE_ANALYSIS) -> dict:
+    # PNG data is already deflate-compressed, so random bytes are a fair stand-in
+    images = [
+        "data:image/png;base64," + base64.b64encode(os.urandom(image_kb * 1024)).decode()
+        for _ in range(n_images)
+    ]
+    return {
+        "id": 12345, "patient_name": "Doe", "specialty": "internal_medicine", "status": "completed",
+        "note": ("Doe, 67F with RA on prednisone, T2DM, HTN and prior nephrolithiasis, presenting with "
+                 "2 days of dysuria, right flank pain and rigors. T 38.9, HR 118, BP 84/52, RR 24, "
+                 "SpO2 96% RA. Lactate 4.1, WBC 17.8, Cr 2.3 (baseline 0.9). UA: nitrite +, LE 3+."),
+        "analysis": analysis, "images_json": images,
+        "detected_conditions": ["sepsis"],
+        "created_at": datetime.now(), "updated_at": datetime.now(),
+    }
+
+
+def stock_dumps(obj) -> str:
+    """Roughly what Flask's DefaultJSONProvider does (stdlib json, http-date datetimes)."""
+    from email.utils import format_datetime
+    return json.dumps(obj, default=lambda o: format_datetime(o) if isinstance(o, datetime) else str(o))
+
+
+def time_it(fn, obj, runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn(obj)
+        samples.append(time.perf_counter() - t0)
+    return statistics.median(samples)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="JSON encode time and compressed sizes for large payloads.")
+    parser.add_argument("--images", type=int, default=2)
+    parser.add_argument("--image-kb", type=int, default=256)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--analysis-file", default=None, help="use this analysis text instead of the sample")
+    args = parser.parse_args(argv)
+
+    analysis = SAMPLE_ANALYSIS
+    if args.analysis_file:
+        with open(args.analysis_file, encoding="utf-8") as f:
+            analysis = f.read()
+    record = sample_record(args.images, args.image_kb, analysis)
+    print(f"serializer={http_encoding.JSON_SERIALIZER} orjson={http_encoding.HAVE_ORJSON} "
+          f"brotli={http_encoding.HAVE_BROTLI}")
+    before = time_it(stock_dumps, record, args.runs)
+    after = time_it(http_encoding.dumps, record, args.runs)
+    print(f"encode  stock {before * 1000:8.2f} ms   fast {after * 1000:8.2f} ms   x{before / after:5.1f}")
+
+    for label, payload in (("analysis only", {k: v for k, v in record.items() if k != "images_json"}),
+                           ("with images", record)):
+        body = http_encoding.dumps(payload).encode()
+        sizes = [f"identity {len(body):>10,d} B"]
+        for enc in ("gzip", "br"):
+            if enc == "br" and not http_encoding.HAVE_BROTLI:
+                continue
+            t0 = time.perf_counter()
+            size = len(http_encoding.compress(body, enc))
+            sizes.append(f"{enc} {size:>10,d} B ({(time.perf_counter() - t0) * 1000:.1f} ms)")
+        print(f"{label:>14}: " + "   ".join(sizes))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Cold-start benchmark: import time of the app module and time until /health answers.
+
+    python bench_startup.py --app app-2.py --runs 5
+
+Each run uses a fresh interpreter. OPENAI_API_KEY defaults to a dummy value
+since nothing here calls the API; the embedded worker is disabled.
+"""
+from __future__ import annotations
+import argparse, os, socket, statistics, subprocess, sys, time, urllib.request
+from pathlib import Path
+
+HERE = Path(__file__).parent
+
+IMPORT_SNIPPET = """
+import importlib.util, sys, time
+t0 = time.perf_counter()
+spec = importlib.util.spec_from_file_location("bench_app", sys.argv[1])
+mod = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mod)
+print(time.perf_counter() - t0)
+"""
+
+
+def bench_env(port: int | None = None) -> dict:
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "sk-bench")
+    env["EMBEDDED_WORKER"] = "0"
+    if port:
+        env["PORT"] = str(port)
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_import(app_path: Path) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET, str(app_path)],
+                         env=bench_env(), capture_output=True, text=True, check=True, cwd=HERE)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def time_first_health(app_path: Path, timeout: float = 60.0) -> float:
+    port = free_port()
+    url = f"http://127.0.0.1:{port}/health"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, str(app_path)], env=bench_env(port), cwd=HERE,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            try:
+                with urllib.request.urlopen(url, timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"/health did not answer within {timeout:.0f}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import time and time to first /health.")
+    parser.add_argument("--app", default="app-2.py", help="app file relative to api/")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    app_path = HERE / args.app
+    imports = [time_import(app_path) for _ in range(args.runs)]
+    healths = [time_first_health(app_path) for _ in range(args.runs)]
+    print(f"{args.app}: runs={args.runs}")
+    print(f"  import        median {statistics.median(imports) * 1000:8.1f} ms   max {max(imports) * 1000:8.1f} ms")
+    print(f"  first /health median {statistics.median(healths) * 1000:8.1f} ms   max {max(healths) * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Response encoding shared by app.py and app-2.py: a pluggable fast JSON
+serializer and gzip/brotli content negotiation.
+
+    from http_encoding import install_json, install_compression, dumps
+    install_json(app)
+    install_compression(app)
+
+JSON_SERIALIZER=orjson|stdlib picks the encoder (orjson if installed by default).
+Both write datetimes as ISO 8601. RESPONSE_COMPRESSION=0 turns compression off;
+SSE responses are only compressed when SSE_COMPRESSION=1.
+"""
+from __future__ import annotations
+import gzip, json, os, zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+    HAVE_ORJSON = True
+except Exception:
+    orjson = None
+    HAVE_ORJSON = False
+
+try:
+    import brotli
+    HAVE_BROTLI = True
+except Exception:
+    brotli = None
+    HAVE_BROTLI = False
+
+JSON_SERIALIZER = os.getenv("JSON_SERIALIZER", "orjson" if HAVE_ORJSON else "stdlib")
+RESPONSE_COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1") == "1"
+SSE_COMPRESSION = os.getenv("SSE_COMPRESSION", "0") == "1"
+COMPRESS_MIN_RESPONSE_BYTES = int(os.getenv("COMPRESS_MIN_RESPONSE_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "text/html", "text/plain"}
+
+
+# ---------- JSON ----------
+def _default(obj):
+    """Types orjson handles natively that the stdlib encoder does not."""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return obj.decode("utf-8", "replace")
+    if isinstance(obj, set):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> str:
+    if JSON_SERIALIZER == "orjson" and HAVE_ORJSON:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=_default, separators=(",", ":"))
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumps() above; used by jsonify()."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if JSON_SERIALIZER == "orjson" and HAVE_ORJSON:
+            return orjson.loads(s)
+        return json.loads(s)
+
+
+def install_json(app):
+    app.json = FastJSONProvider(app)
+
+
+# ---------- Compression ----------
+def choose_encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header (q=0 excludes); None for identity."""
+    offered = {}
+    for part in (accept_encoding or "").lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name] = q
+    if HAVE_BROTLI and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", offered.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _gzip_stream(chunks):
+    """Gzip a streamed body, sync-flushing after every chunk so SSE events still arrive promptly."""
+    comp = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        yield comp.compress(chunk) + comp.flush(zlib.Z_SYNC_FLUSH)
+    yield comp.flush()
+
+
+def install_compression(app):
+    @app.after_request
+    def compress_response(response):
+        if not RESPONSE_COMPRESSION or "Content-Encoding" in response.headers:
+            return response
+        if response.status_code < 200 or response.status_code in (204, 304):
+            return response
+
+        encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+        response.vary.add("Accept-Encoding")
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            # SSE stays uncompressed unless explicitly enabled (proxies may buffer it)
+            if response.mimetype == "text/event-stream" and SSE_COMPRESSION and encoding == "gzip":
+                response.response = _gzip_stream(response.response)
+                response.headers["Content-Encoding"] = "gzip"
+                response.headers.pop("Content-Length", None)
+            return response
+
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough:
+            return response
+        body = response.get_data()
+        if len(body) < COMPRESS_MIN_RESPONSE_BYTES:
+            return response
+        response.set_data(compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    return compress_response
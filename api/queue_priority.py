@@ -0,0 +1,87 @@
+"""
+Queue priority for async analyses: a caller-requested level, raised when the
+note mentions a time-critical condition.
+
+    from queue_priority import PRIORITY_NAMES, job_priority
+    priority = job_priority(note, request.form.get("priority"))
+
+Triggers are matched as whole words and only name acute presentations: bare
+abbreviations that also mean something routine ("PE:" the exam header, "CVA
+tenderness", "TIA" and "MI" in past history) are left out. A mention is ignored
+when its clause negates it or places it in the past ("no DVT", "sepsis ruled
+out", "hx of DKA"). The list is kept separate from GUIDANCE_DATA on purpose:
+extra guidance in a prompt is cheap, jumping the queue is not.
+"""
+from __future__ import annotations
+import re
+
+PRIORITY_LEVELS = {"normal": 0, "high": 1, "urgent": 2}
+PRIORITY_NAMES = {v: k for k, v in PRIORITY_LEVELS.items()}
+
+# Time-critical core measures jump the queue: condition -> (priority, triggers)
+PRIORITY_TRIGGERS = {
+    "sepsis": (PRIORITY_LEVELS["urgent"], ["sepsis", "septic shock", "severe sepsis", "sep-1"]),
+    "ami":    (PRIORITY_LEVELS["urgent"], ["ami", "acute mi", "acute myocardial infarction", "stemi", "nstemi"]),
+    "stroke": (PRIORITY_LEVELS["urgent"], ["acute stroke", "code stroke", "stroke alert",
+                                           "acute ischemic stroke", "hemorrhagic stroke"]),
+    "dka":    (PRIORITY_LEVELS["high"],   ["dka", "diabetic ketoacidosis", "hhs",
+                                           "hyperosmolar hyperglycemic state"]),
+    "vte":    (PRIORITY_LEVELS["high"],   ["vte", "venous thromboembolism", "dvt", "deep vein thrombosis",
+                                           "pulmonary embolism", "pe on cta", "pe on ct"]),
+}
+
+_TRIGGER_RES = {
+    cond: (level, re.compile(r"\b(?:" + "|".join(re.escape(t) for t in triggers) + r")\b", re.IGNORECASE))
+    for cond, (level, triggers) in PRIORITY_TRIGGERS.items()
+}
+
+# A clause ends at punctuation, a line break or "but". Commas count too, so "no fever,
+# concern for sepsis" stays urgent (at the cost of "no DVT, PE" reading the second as affirmed)
+_CLAUSE_BREAK_RE = re.compile(r"[.,;:!?\n]|\bbut\b", re.IGNORECASE)
+# Cues before the mention in the same clause ...
+_NEGATED_BEFORE_RE = re.compile(
+    r"\b(?:no|not|denies|denied|without|negative for|free of|ruled out|"
+    r"history of|hx of|h/o|prior|previous|remote|resolved)\b", re.IGNORECASE)
+# ... or after it
+_NEGATED_AFTER_RE = re.compile(
+    r"\b(?:ruled out|excluded|unlikely|resolved|negative|in the past)\b", re.IGNORECASE)
+
+
+def _clause_around(text: str, start: int, end: int) -> tuple:
+    """(text before, text after) the span, cut at the enclosing clause's boundaries."""
+    breaks_before = list(_CLAUSE_BREAK_RE.finditer(text, 0, start))
+    before = text[breaks_before[-1].end() if breaks_before else 0:start]
+    break_after = _CLAUSE_BREAK_RE.search(text, end)
+    after = text[end:break_after.start() if break_after else len(text)]
+    return before, after
+
+
+def _affirmed(text: str, pattern) -> bool:
+    """True if some mention of the pattern is neither negated nor historical."""
+    for m in pattern.finditer(text):
+        before, after = _clause_around(text, m.start(), m.end())
+        if not _NEGATED_BEFORE_RE.search(before) and not _NEGATED_AFTER_RE.search(after):
+            return True
+    return False
+
+
+def parse_priority(raw) -> int:
+    """Accept 0-2 or normal/high/urgent; anything else is treated as normal."""
+    if raw is None or raw == "":
+        return 0
+    if isinstance(raw, str) and raw.strip().lower() in PRIORITY_LEVELS:
+        return PRIORITY_LEVELS[raw.strip().lower()]
+    try:
+        return max(0, min(int(raw), max(PRIORITY_LEVELS.values())))
+    except (TypeError, ValueError):
+        return 0
+
+
+def priority_conditions(note: str) -> list:
+    """Time-critical conditions named in the note."""
+    return [cond for cond, (_, pattern) in _TRIGGER_RES.items() if _affirmed(note or "", pattern)]
+
+
+def job_priority(note: str, requested=None) -> int:
+    derived = max((_TRIGGER_RES[c][0] for c in priority_conditions(note)), default=0)
+    return max(parse_priority(requested), derived)
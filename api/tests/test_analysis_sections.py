@@ -0,0 +1,70 @@
+from analysis_sections import SECTION_KEYS, current_section, parse_sections
+
+NUMBERED = """Summary of the case.
+
+1. Differential Diagnosis
+Community-acquired pneumonia vs. PE.
+
+2. Pathophysiology Integration
+Hypoxemia from V/Q mismatch.
+
+3. Diagnostic Workup
+CBC, BMP, lactate, blood cultures.
+Diagnostic workup should include lactate.
+
+4. Treatment and Medications
+Ceftriaxone 1 g IV q24h plus azithromycin.
+Treatment and medications are as follows: continue home meds.
+"""
+
+
+def test_numbered_headings():
+    sections = parse_sections(NUMBERED)
+    assert list(sections) == SECTION_KEYS[:4]
+    assert sections["differential_diagnosis"] == "Community-acquired pneumonia vs. PE."
+    assert sections["pathophysiology"] == "Hypoxemia from V/Q mismatch."
+
+
+def test_title_words_in_body_are_not_headings():
+    sections = parse_sections(NUMBERED)
+    assert sections["diagnostic_workup"] == (
+        "CBC, BMP, lactate, blood cultures.\nDiagnostic workup should include lactate.")
+    assert sections["treatment_medications"].endswith(
+        "Treatment and medications are as follows: continue home meds.")
+
+
+def test_markdown_headings_and_text_after_colon():
+    text = ("## Differential Diagnosis\nSepsis.\n"
+            "**3. Diagnostic Workup:** Lactate, cultures.\n"
+            "**Treatment and Medications**:\nFluids.\n")
+    assert parse_sections(text) == {
+        "differential_diagnosis": "Sepsis.",
+        "diagnostic_workup": "Lactate, cultures.",
+        "treatment_medications": "Fluids.",
+    }
+
+
+def test_bare_title_line_needs_a_prefix():
+    text = "1. Differential Diagnosis\nSepsis.\nDiagnostic Workup:\nnot a heading\n"
+    assert parse_sections(text) == {
+        "differential_diagnosis": "Sepsis.\nDiagnostic Workup:\nnot a heading",
+    }
+
+
+def test_headings_must_follow_section_order():
+    text = ("1. Differential Diagnosis\nA.\n3. Diagnostic Workup\nB.\n"
+            "1. Differential Diagnosis\nrepeated\n4. Treatment and Medications\nC.\n")
+    sections = parse_sections(text)
+    assert sections["diagnostic_workup"] == "B.\n1. Differential Diagnosis\nrepeated"
+    assert sections["treatment_medications"] == "C."
+
+
+def test_no_headings():
+    assert parse_sections("") == {}
+    assert parse_sections("Differential diagnosis is broad.") == {}
+
+
+def test_current_section():
+    assert current_section("") is None
+    assert current_section(NUMBERED) == "treatment_medications"
+    assert current_section("1. Differential Diagnosis\nSepsis. Diagnostic Workup") == "differential_diagnosis"
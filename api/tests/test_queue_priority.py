@@ -0,0 +1,62 @@
+import pytest
+
+from queue_priority import PRIORITY_LEVELS, job_priority, parse_priority, priority_conditions
+
+NORMAL, HIGH, URGENT = PRIORITY_LEVELS["normal"], PRIORITY_LEVELS["high"], PRIORITY_LEVELS["urgent"]
+
+
+@pytest.mark.parametrize("note", [
+    "Smith, 45F admitted with mild cough, family history of asthma",
+    "Routine follow-up for vitamin D deficiency",
+    "Longstanding hypertension, well controlled",
+    "Started amiodarone last year; mild dementia; pes planus",
+    "PE: lungs clear to auscultation",
+    "No CVA tenderness, dysuria x3d",
+    "Hx of TIA 2010, here for med refill",
+    "Hx of MI, stable on aspirin",
+    "CTA negative for PE",
+    "",
+    None,
+])
+def test_ordinary_notes_stay_normal(note):
+    assert priority_conditions(note) == []
+    assert job_priority(note) == NORMAL
+
+
+@pytest.mark.parametrize("note, expected", [
+    ("67M with fever, hypotension, concern for sepsis", URGENT),
+    ("Chest pain, troponin rising, NSTEMI on ECG", URGENT),
+    ("Troponin rising, r/o NSTEMI", URGENT),
+    ("Sudden left-sided weakness, code stroke called", URGENT),
+    ("No fever, concern for sepsis", URGENT),
+    ("Known DKA, glucose 540", HIGH),
+    ("Swollen left calf, DVT suspected", HIGH),
+    ("Saddle PE on CTA", HIGH),
+])
+def test_time_critical_conditions_raise_priority(note, expected):
+    assert job_priority(note) == expected
+
+
+@pytest.mark.parametrize("note", [
+    "Sepsis ruled out, discharge planning",
+    "Denies chest pain; no DVT on duplex",
+    "History of DKA, now tolerating diet",
+    "Septic shock resolved after 5 days of cefepime",
+    "Sepsis unlikely given normal lactate",
+])
+def test_negated_or_historical_mentions_stay_normal(note):
+    assert job_priority(note) == NORMAL
+
+
+def test_requested_priority_is_a_floor():
+    assert job_priority("Longstanding hypertension", "urgent") == URGENT
+    assert job_priority("concern for sepsis", "normal") == URGENT
+    assert job_priority("Known DKA", 2) == URGENT
+
+
+@pytest.mark.parametrize("raw, expected", [
+    (None, NORMAL), ("", NORMAL), ("High", HIGH), (" urgent ", URGENT),
+    ("1", HIGH), (7, URGENT), (-3, NORMAL), ("soon", NORMAL),
+])
+def test_parse_priority(raw, expected):
+    assert parse_priority(raw) == expected
@@ -0,0 +1,139 @@
+"""
+Standalone job worker, decoupled from the web server.
+
+    python -m worker --processes 2 --concurrency 4
+
+Runs N worker processes, each with C threads claiming jobs from
+clinical_analyses. SIGTERM / SIGINT stop new claims and let in-flight jobs
+finish (up to --drain-timeout seconds, shared by all processes) before
+exiting. Processes still busy at the deadline are killed and their jobs are
+put back to pending. A process that crashes is restarted and its jobs are
+requeued at once; if they keep crashing right after start, the worker exits
+non-zero. Jobs left by a worker on another host are requeued by the
+STALE_CLAIM_SECONDS sweep.
+
+Run the web processes with EMBEDDED_WORKER=0 so they don't poll as well.
+"""
+from __future__ import annotations
+import argparse, importlib.util, multiprocessing, os, signal, sys, threading, time
+from pathlib import Path
+
+# The web app must not start its own poller inside the worker processes
+os.environ["EMBEDDED_WORKER"] = "0"
+
+APP_PATH = Path(__file__).parent / "app-2.py"
+RESTART_WINDOW_SECONDS = 10   # a process that dies sooner than this after start counts as a crash loop
+MAX_QUICK_RESTARTS = 5
+
+
+def load_app():
+    """app-2.py isn't importable by name (hyphen), so load it from its path."""
+    spec = importlib.util.spec_from_file_location("roundsiq_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_process(index: int, concurrency: int):
+    """Body of one worker process: C job loops sharing a stop event."""
+    app = load_app()
+    stop = threading.Event()
+
+    def on_signal(signum, frame):
+        print(f"[worker {index}] signal {signum}, draining...")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    app.ensure_columns()
+    threads = [
+        threading.Thread(target=app.process_pending_jobs, args=(stop,), name=f"worker-{index}-{n}")
+        for n in range(concurrency)
+    ]
+    for t in threads:
+        t.start()
+    print(f"[worker {index}] pid={os.getpid()} running {concurrency} job loop(s)")
+    for t in threads:
+        t.join()
+    print(f"[worker {index}] drained, exiting")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m worker", description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--processes", type=int, default=int(os.getenv("WORKER_PROCESSES", "1")))
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("WORKER_CONCURRENCY", "2")),
+                        help="job loops (threads) per process")
+    parser.add_argument("--drain-timeout", type=float, default=float(os.getenv("WORKER_DRAIN_TIMEOUT", "300")),
+                        help="seconds to wait for in-flight jobs after SIGTERM")
+    args = parser.parse_args(argv)
+
+    def spawn(i):
+        return multiprocessing.Process(target=run_process, args=(i, max(1, args.concurrency)), name=f"worker-{i}")
+
+    procs = [spawn(i) for i in range(max(1, args.processes))]
+    stopping = threading.Event()
+    exit_code = 0
+
+    def on_signal(signum, frame):
+        if stopping.is_set():
+            return
+        stopping.set()
+        print(f"[worker] signal {signum}, stopping {len(procs)} process(es)")
+        for p in procs:
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+
+    for p in procs:
+        p.start()
+
+    # The archiver takes a MySQL named lock, so running it here alongside web processes is safe
+    app = load_app()
+    if app.ARCHIVE_AFTER_DAYS > 0:
+        threading.Thread(target=app.run_archiver, daemon=True).start()
+
+    # Restart crashed processes (their jobs go straight back to pending) unless they
+    # keep dying right after start, in which case give up and exit non-zero
+    quick_crashes = 0
+    started_at = {p.name: time.monotonic() for p in procs}
+    while not stopping.is_set():
+        for i, p in enumerate(procs):
+            if p.is_alive() or stopping.is_set():
+                continue
+            p.join()
+            print(f"[worker] {p.name} (pid {p.pid}) exited with code {p.exitcode}")
+            try:
+                print(f"[worker] requeued {app.requeue_worker_claims([app.worker_id(p.pid)])} job(s) from it")
+            except Exception as e:
+                print("[worker] could not requeue its jobs (the stale-claim sweep will):", e)
+            quick_crashes = quick_crashes + 1 if time.monotonic() - started_at[p.name] < RESTART_WINDOW_SECONDS else 0
+            if quick_crashes > MAX_QUICK_RESTARTS:
+                print(f"[worker] processes keep exiting within {RESTART_WINDOW_SECONDS}s of start, giving up")
+                exit_code = 1
+                on_signal(signal.SIGTERM, None)
+                break
+            procs[i] = spawn(i)
+            procs[i].start()
+            started_at[p.name] = time.monotonic()
+        stopping.wait(1)
+
+    deadline = time.monotonic() + args.drain_timeout
+    killed = []
+    for p in procs:
+        p.join(max(0.0, deadline - time.monotonic()))
+        if p.is_alive():
+            print(f"[worker] {p.name} did not drain in {args.drain_timeout:.0f}s, killing")
+            p.kill()
+            p.join()
+            killed.append(app.worker_id(p.pid))
+    if killed:
+        print(f"[worker] requeued {app.requeue_worker_claims(killed)} job(s) from killed processes")
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())